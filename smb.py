@@ -6,22 +6,96 @@
 ║   Authentic World 1-1 • Full Sprites • 60FPS • No External Assets            ║
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
+import time
+IMPORT_START = time.perf_counter()  # Startup report measures from here
+
+import os
 import sys
+import copy
+import mmap
+import json
+import struct
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict, deque
 import pygame
-from enum import Enum
+from enum import Enum, IntFlag
 from dataclasses import dataclass
 from typing import List, Tuple
 
+try:
+    import numpy as np
+except ImportError:  # Optional - only speeds up sprite baking
+    np = None
+
 # ─────────────────────────────────────────────────────────────
 # CONFIG & INIT - FAMICOM ACCURATE
 # ─────────────────────────────────────────────────────────────
-pygame.init()
-pygame.display.set_caption("ULTRA MARIO 2D BROS [C] Samsoft 2026")
+class StartupTimer:
+    """Where the time goes between importing this module and the first frame.
 
-try:
-    pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=512)
-except:
-    pass
+    mark() closes the current phase; lazy() times work done on first use,
+    which may land before or after the first frame.
+    """
+    def __init__(self, start):
+        self.start = self.last = start
+        self.phases = []
+        self.loads = []
+        self.first_frame = None
+        self.verbose = False
+
+    def mark(self, label):
+        now = time.perf_counter()
+        self.phases.append((label, now - self.last))
+        self.last = now
+
+    def lazy(self, label, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        self.loads.append((label, start - self.start, elapsed))
+        if self.verbose and self.first_frame is not None:
+            print("startup: %s loaded at +%.1f ms in %.1f ms" % (label, (start - self.start) * 1000, elapsed * 1000))
+        return result
+
+    def frame_presented(self):
+        if self.first_frame is None:
+            self.mark("first frame")
+            self.first_frame = self.last - self.start
+            if self.verbose:
+                print(self.report())
+
+    def report(self):
+        lines = ["startup: first frame after %.1f ms" % (self.first_frame * 1000)]
+        for label, elapsed in self.phases:
+            lines.append("  %-26s %7.1f ms" % (label, elapsed * 1000))
+        for label, at, elapsed in self.loads:
+            lines.append("  %-26s %7.1f ms  (lazy, at +%.1f ms)" % (label, elapsed * 1000, at * 1000))
+        return "\n".join(lines)
+
+STARTUP = StartupTimer(IMPORT_START)
+STARTUP.mark("library imports")
+
+def init_display():
+    """Bring up video and fonts for a windowed run. Headless simulation never calls this.
+
+    Only the subsystems the first frame needs are started; the audio
+    device is opened later by init_mixer().
+    """
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_caption("ULTRA MARIO 2D BROS [C] Samsoft 2026")
+
+def init_mixer():
+    """Open the audio device; True if sound is available. Safe to call again."""
+    if pygame.mixer.get_init():
+        return True
+    try:
+        pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=512)
+    except pygame.error:
+        return False
+    return True
 
 SCALE = 3
 NES_PIXEL = SCALE
@@ -29,6 +103,8 @@ TILE_SIZE = 16 * NES_PIXEL
 SCREEN_W = 256 * NES_PIXEL
 SCREEN_H = 240 * NES_PIXEL
 FPS = 60  # Famicom NTSC
+MAX_CATCHUP = 5  # Most simulation steps run before a frame must be presented
+CHUNK_COLS = 16  # Level columns per entity/render chunk
 
 # Physics tuned to match original SMB feel
 GRAVITY = 0.4 * NES_PIXEL
@@ -624,53 +700,225 @@ STAR_PALETTE = {'Y': C.COIN_I, 'K': C.BLACK}
 # ─────────────────────────────────────────────────────────────
 # GRAPHICS ENGINE
 # ─────────────────────────────────────────────────────────────
+SPRITE_PX = 16  # Sprite grids are baked at 16x16 NES pixels
+
+def _grid_rows(grid):
+    """Clip/pad a character grid to exactly SPRITE_PX x SPRITE_PX."""
+    rows = [row[:SPRITE_PX].ljust(SPRITE_PX, '.') for row in grid[:SPRITE_PX]]
+    rows += ['.' * SPRITE_PX] * (SPRITE_PX - len(rows))
+    return rows
+
+def bake_sprite_rgba(grid, palette):
+    """Convert a character grid to raw 16x16 RGBA bytes in one pass.
+
+    Characters missing from the palette are transparent. Uses a NumPy
+    lookup table when available, otherwise a per-row bytes join.
+    """
+    rows = _grid_rows(grid)
+    if np is not None:
+        lut = np.zeros((256, 4), dtype=np.uint8)
+        for char, color in palette.items():
+            lut[ord(char)] = (color[0], color[1], color[2], 255)
+        codes = np.frombuffer("".join(rows).encode("latin-1"), dtype=np.uint8)
+        return lut[codes].tobytes()
+    
+    lut = {char: bytes((color[0], color[1], color[2], 255)) for char, color in palette.items()}
+    clear = bytes(4)
+    return b"".join(lut.get(char, clear) for row in rows for char in row)
+
 def create_sprite_surface(grid, palette):
-    s = pygame.Surface((16 * NES_PIXEL, 16 * NES_PIXEL)).convert_alpha()
-    s.fill((0,0,0,0))
-    for r, row in enumerate(grid):
-        for c, char in enumerate(row):
-            if char in palette:
-                pygame.draw.rect(s, palette[char], (c*NES_PIXEL, r*NES_PIXEL, NES_PIXEL, NES_PIXEL))
+    base = pygame.image.frombuffer(bake_sprite_rgba(grid, palette), (SPRITE_PX, SPRITE_PX), "RGBA")
+    s = pygame.transform.scale(base, (SPRITE_PX * NES_PIXEL, SPRITE_PX * NES_PIXEL))
+    if pygame.display.get_surface() is not None:
+        s = s.convert_alpha()
     return s
 
+ATLAS_VERSION = 1
+
+# Mario frames that get pre-flipped and pre-tinted variants
+MARIO_FRAMES = ("mario_stand", "mario_run1", "mario_run2", "mario_run3", "mario_jump")
+# Star power cycles through these additive tints, 4 frames each
+STAR_TINTS = [(255,0,0), (0,255,0), (0,0,255), (255,255,0), (255,0,255), (0,255,255)]
+
+def sprite_cache_dir():
+    """Where baked sprite atlases and compiled levels live. Override with SMB_CACHE_DIR."""
+    return os.environ.get("SMB_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "ultramario2dbros")
+
+def sprite_table_key(table):
+    """Hash of every grid, palette and SCALE that feeds the atlas."""
+    h = hashlib.sha1()
+    h.update(("v%d scale=%d\n" % (ATLAS_VERSION, NES_PIXEL)).encode())
+    for name, grid, palette in table:
+        h.update(name.encode())
+        h.update("\n".join(grid).encode())
+        h.update(repr(sorted(palette.items())).encode())
+    return h.hexdigest()[:16]
+
+def atlas_layout(table):
+    """Atlas surface size and the name -> Rect index that table bakes to."""
+    size = SPRITE_PX * NES_PIXEL
+    cols = max(1, int(len(table) ** 0.5 + 0.999))
+    rows = (len(table) + cols - 1) // cols
+    index = {name: pygame.Rect((i % cols) * size, (i // cols) * size, size, size)
+             for i, (name, _, _) in enumerate(table)}
+    return (cols * size, rows * size), index
+
+def build_sprite_atlas(table):
+    """Bake every sprite in table into one surface plus a name -> Rect index."""
+    atlas_size, index = atlas_layout(table)
+    atlas = pygame.Surface(atlas_size, pygame.SRCALPHA)
+    for name, grid, palette in table:
+        atlas.blit(create_sprite_surface(grid, palette), index[name])
+    return atlas, index
+
+def load_sprite_atlas(table, cache_dir=None):
+    """Load the atlas for table from disk, baking and saving it on a miss.
+
+    A cached atlas is only used when its size and index match the layout
+    table bakes to; anything stale or damaged is rebaked.
+    """
+    cache_dir = cache_dir or sprite_cache_dir()
+    key = sprite_table_key(table)
+    image_path = os.path.join(cache_dir, "atlas-%s.png" % key)
+    index_path = os.path.join(cache_dir, "atlas-%s.json" % key)
+    
+    try:
+        with open(index_path) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("atlas index is not an object")
+        index = {name: pygame.Rect(r) for name, r in data.items()}
+        atlas = pygame.image.load(image_path)
+        atlas_size, layout = atlas_layout(table)
+        if atlas.get_size() == atlas_size and index == layout:
+            return atlas, index
+    except (OSError, ValueError, TypeError, pygame.error):
+        pass
+    
+    atlas, index = build_sprite_atlas(table)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write under temp names so concurrent launches never see half a file
+        tmp = "%s.%d" % (key, os.getpid())
+        tmp_image = os.path.join(cache_dir, "atlas-%s.png" % tmp)
+        tmp_index = os.path.join(cache_dir, "atlas-%s.json.tmp" % tmp)
+        pygame.image.save(atlas, tmp_image)
+        with open(tmp_index, "w") as f:
+            json.dump({name: list(r) for name, r in index.items()}, f)
+        os.replace(tmp_image, image_path)
+        os.replace(tmp_index, index_path)
+    except (OSError, pygame.error):
+        pass  # Cache is best-effort; a read-only disk just means baking each launch
+    return atlas, index
+
 class Assets:
-    def __init__(self):
-        self.mario_stand = create_sprite_surface(S_MARIO_STAND, MARIO_PALETTE)
-        self.mario_run1 = create_sprite_surface(S_MARIO_RUN1, MARIO_PALETTE)
-        self.mario_run2 = create_sprite_surface(S_MARIO_RUN2, MARIO_PALETTE)
-        self.mario_run3 = create_sprite_surface(S_MARIO_RUN3, MARIO_PALETTE)
-        self.mario_jump = create_sprite_surface(S_MARIO_JUMP, MARIO_PALETTE)
-        
-        self.goomba1 = create_sprite_surface(S_GOOMBA1, GOOMBA_PALETTE)
-        self.goomba2 = create_sprite_surface(S_GOOMBA2, GOOMBA_PALETTE)
-        self.goomba_flat = create_sprite_surface(S_GOOMBA_FLAT, GOOMBA_PALETTE)
-        
-        self.koopa1 = create_sprite_surface(S_KOOPA1, KOOPA_PALETTE)
-        
-        self.tile_ground = create_sprite_surface(TILE_GROUND, TILE_PALETTE)
-        self.tile_brick = create_sprite_surface(TILE_BRICK, TILE_PALETTE)
-        self.tile_q = create_sprite_surface(TILE_QBLOCK, TILE_PALETTE)
-        self.tile_q_off = create_sprite_surface(TILE_QBLOCK_OFF, TILE_PALETTE)
-        self.tile_stair = create_sprite_surface(TILE_STAIR, TILE_PALETTE)
-        
-        self.pipe_tl = create_sprite_surface(TILE_PIPE_TL, TILE_PALETTE)
-        self.pipe_tr = create_sprite_surface(TILE_PIPE_TR, TILE_PALETTE)
-        self.pipe_l = create_sprite_surface(TILE_PIPE_L, TILE_PALETTE)
-        self.pipe_r = create_sprite_surface(TILE_PIPE_R, TILE_PALETTE)
-        
-        self.flag_pole = create_sprite_surface(TILE_FLAG_POLE, TILE_PALETTE)
-        self.flag_top = create_sprite_surface(TILE_FLAG_TOP, TILE_PALETTE)
-        self.flag = create_sprite_surface(TILE_FLAG, TILE_PALETTE)
-        self.castle = create_sprite_surface(TILE_CASTLE, TILE_PALETTE)
-        
-        self.coin = create_sprite_surface(S_COIN, TILE_PALETTE)
-        self.mushroom = create_sprite_surface(S_MUSHROOM, MUSH_PALETTE)
-        self.mushroom_1up = create_sprite_surface(S_MUSHROOM_1UP, MUSH_PALETTE)
-        self.fireflower = create_sprite_surface(S_FIREFLOWER, FLOWER_PALETTE)
-        self.starman = create_sprite_surface(S_STARMAN, STAR_PALETTE)
+    """Every sprite, sliced out of one atlas surface.
+
+    Sprites are subsurfaces named after their SPRITE_TABLE entry, so
+    GFX.mario_stand etc. share the atlas pixels. `atlas` and `regions`
+    allow batched blits straight from the single source surface.
+    
+    Mario's draw variants are built once, the first time gameplay draws
+    him, so drawing never allocates: mario_frames[name][facing_right] and
+    mario_star[name][tint][facing_right]. The title screen never needs them.
+    """
+    def __init__(self, cache_dir=None):
+        self.atlas, self.regions = load_sprite_atlas(SPRITE_TABLE, cache_dir)
+        if pygame.display.get_surface() is not None:
+            self.atlas = self.atlas.convert_alpha()
+        for name, rect in self.regions.items():
+            setattr(self, name, self.atlas.subsurface(rect))
+
+    def __getattr__(self, name):
+        # Only reached while the Mario variants have not been built yet
+        if name in ("mario_frames", "mario_star"):
+            STARTUP.lazy("Mario sprite variants", self.build_mario_variants)
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def build_mario_variants(self):
+        self.mario_frames = {}
+        self.mario_star = {}
+        for name in MARIO_FRAMES:
+            right = getattr(self, name)
+            facing = (pygame.transform.flip(right, True, False), right)
+            self.mario_frames[name] = facing
+            tinted = []
+            for color in STAR_TINTS:
+                pair = []
+                for sprite in facing:
+                    temp = sprite.copy()
+                    temp.fill(color, special_flags=pygame.BLEND_ADD)
+                    pair.append(temp)
+                tinted.append(tuple(pair))
+            self.mario_star[name] = tinted
 
 GFX = None
 
+# ─────────────────────────────────────────────────────────────
+# TEXT - rendered-string cache and glyph atlas for numbers
+# ─────────────────────────────────────────────────────────────
+class TextCache:
+    """LRU-bounded cache of rendered text keyed by (font, text, colour).
+
+    Font rasterisation is the most expensive call in the menu and HUD
+    paths; static strings are rendered once and reused every frame.
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surf = self.entries.get(key)
+        if surf is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return surf
+        self.misses += 1
+        surf = self.entries[key] = font.render(text, True, color)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return surf
+
+    def clear(self):
+        self.entries.clear()
+
+TEXT_CACHE = TextCache()
+
+class GlyphAtlas:
+    """One font/colour's glyphs packed side by side in a single surface.
+
+    For fast-changing strings (score, coins, time) drawing is one
+    Surface.blits call of atlas areas instead of a font.render.
+    """
+    def __init__(self, font, color, chars):
+        glyphs = [font.render(ch, True, color) for ch in chars]
+        width = sum(g.get_width() for g in glyphs)
+        self.height = max(g.get_height() for g in glyphs)
+        self.atlas = pygame.Surface((width, self.height), pygame.SRCALPHA)
+        self.areas = {}
+        x = 0
+        for ch, g in zip(chars, glyphs):
+            self.atlas.blit(g, (x, 0))
+            self.areas[ch] = pygame.Rect(x, 0, g.get_width(), self.height)
+            x += g.get_width()
+
+    def draw(self, surf, text, pos):
+        """Blit text at pos; characters not in the atlas are skipped."""
+        x, y = pos
+        batch = []
+        for ch in text:
+            area = self.areas.get(ch)
+            if area is not None:
+                batch.append((self.atlas, (x, y), area))
+                x += area.width
+        surf.blits(batch, doreturn=False)
+        return x - pos[0]
+
 # ─────────────────────────────────────────────────────────────
 # TILE TYPES
 # ─────────────────────────────────────────────────────────────
@@ -697,6 +945,237 @@ SOLID_TILES = {Tile.GROUND, Tile.BRICK, Tile.QBLOCK, Tile.QBLOCK_EMPTY,
                Tile.PIPE_TL, Tile.PIPE_TR, Tile.PIPE_L, Tile.PIPE_R, Tile.STAIR,
                Tile.QBLOCK_MUSH, Tile.QBLOCK_STAR, Tile.QBLOCK_1UP}
 
+# Integer tile ids are the Tile values; these tables map them back
+TILE_BY_ID = {t.value: t for t in Tile}
+TILE_ID_BYTES = bytes(sorted(TILE_BY_ID))
+SOLID_LUT = bytes(1 if TILE_BY_ID.get(i) in SOLID_TILES else 0 for i in range(256))
+
+class TileGrid:
+    """Level tiles as a flat, row-major bytearray of Tile ids.
+
+    Tile stays the public vocabulary for get/set; is_solid is a plain
+    index into SOLID_LUT so the collision hot path never hashes an Enum.
+    Callables in `listeners` are told (x, y) whenever set() changes a cell.
+    
+    freeze() hands out the cells as an immutable buffer that the grid keeps
+    reading from; the first set() afterwards copies it back into a private
+    bytearray, so snapshots share one buffer until the level changes.
+    """
+    def __init__(self, width, height, fill=Tile.AIR):
+        self.width = width
+        self.height = height
+        self.cells = bytearray([fill.value]) * (width * height)
+        self.shared = False
+        self.listeners = []
+
+    @classmethod
+    def from_cells(cls, width, height, cells):
+        grid = cls(width, height)
+        grid.cells[:] = cells
+        return grid
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        return TILE_BY_ID[self.cells[y * self.width + x]]
+
+    def tile_id(self, x, y):
+        return self.cells[y * self.width + x]
+
+    def set(self, x, y, tile):
+        if self.shared:
+            self.cells = bytearray(self.cells)
+            self.shared = False
+        self.cells[y * self.width + x] = tile.value
+        for fn in self.listeners:
+            fn(x, y)
+
+    def is_solid(self, x, y):
+        return SOLID_LUT[self.cells[y * self.width + x]]
+
+    def freeze(self):
+        """The cells as bytes, shared with the grid until its next set()."""
+        if not self.shared:
+            self.cells = bytes(self.cells)
+            self.shared = True
+        return self.cells
+
+    def thaw(self, cells):
+        """Adopt frozen cells from freeze(); listeners hear about changed cells."""
+        old, self.cells, self.shared = self.cells, cells, True
+        if self.listeners and old is not cells:
+            width = self.width
+            for i, (a, b) in enumerate(zip(old, cells)):
+                if a != b:
+                    for fn in self.listeners:
+                        fn(i % width, i // width)
+
+class ChunkedGrid:
+    """TileGrid interface for long, sparse levels, stored in column chunks.
+
+    Each CHUNK_COLS-wide chunk is a column-major run of tile ids. Chunks
+    with identical contents (open sky over flat ground, say) share one
+    immutable bytes object after compact(); set() gives a chunk its own
+    bytearray the first time it is written. Access is a chunk index plus
+    an offset, so it stays O(1).
+    """
+    def __init__(self, width, height, fill=Tile.AIR):
+        self.width = width
+        self.height = height
+        blank = bytes([fill.value]) * (CHUNK_COLS * height)
+        self.chunks = [blank] * ((width + CHUNK_COLS - 1) // CHUNK_COLS)
+        self.listeners = []
+
+    @classmethod
+    def from_grid(cls, grid):
+        """Compacted copy of any grid with the TileGrid interface."""
+        chunked = cls(grid.width, grid.height)
+        for c in range(len(chunked.chunks)):
+            cells = bytearray(CHUNK_COLS * grid.height)
+            for x in range(c * CHUNK_COLS, min(grid.width, (c + 1) * CHUNK_COLS)):
+                for y in range(grid.height):
+                    cells[(x - c * CHUNK_COLS) * grid.height + y] = grid.tile_id(x, y)
+            chunked.chunks[c] = cells
+        chunked.compact()
+        return chunked
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def tile_id(self, x, y):
+        return self.chunks[x // CHUNK_COLS][x % CHUNK_COLS * self.height + y]
+
+    def get(self, x, y):
+        return TILE_BY_ID[self.chunks[x // CHUNK_COLS][x % CHUNK_COLS * self.height + y]]
+
+    def set(self, x, y, tile):
+        c = x // CHUNK_COLS
+        cells = self.chunks[c]
+        if type(cells) is bytes:
+            cells = self.chunks[c] = bytearray(cells)
+        cells[x % CHUNK_COLS * self.height + y] = tile.value
+        for fn in self.listeners:
+            fn(x, y)
+
+    def is_solid(self, x, y):
+        return SOLID_LUT[self.chunks[x // CHUNK_COLS][x % CHUNK_COLS * self.height + y]]
+
+    def compact(self):
+        """Freeze every chunk and let identical chunks share one buffer."""
+        seen = {}
+        for c, cells in enumerate(self.chunks):
+            cells = bytes(cells)
+            self.chunks[c] = seen.setdefault(cells, cells)
+
+    def freeze(self):
+        for c, cells in enumerate(self.chunks):
+            if type(cells) is bytearray:
+                self.chunks[c] = bytes(cells)
+        return tuple(self.chunks)
+
+    def thaw(self, chunks):
+        old, self.chunks = self.chunks, list(chunks)
+        if not self.listeners:
+            return
+        for c, (a, b) in enumerate(zip(old, chunks)):
+            if a is b:
+                continue
+            for i, (p, q) in enumerate(zip(a, b)):
+                if p != q:
+                    for fn in self.listeners:
+                        fn(c * CHUNK_COLS + i // self.height, i % self.height)
+
+def sparse_test_level(width, height=15, seed=1):
+    """Deterministic long level of mostly sky: ground with pits, scattered blocks."""
+    grid = TileGrid(width, height)
+    x = seed
+    for col in range(width):
+        x = (x * 1103515245 + 12345) & 0x7fffffff
+        if (x >> 8) % 40:
+            grid.set(col, height - 2, Tile.GROUND)
+            grid.set(col, height - 1, Tile.GROUND)
+        if (x >> 16) % 23 == 0:
+            grid.set(col, height - 6, (Tile.BRICK, Tile.QBLOCK)[(x >> 4) & 1])
+    return grid
+
+def bench_tiles(levels=None, reads=200000):
+    """Print memory and random-read cost of each tile store.
+
+    levels is a sequence of (name, build) pairs, build returning a grid;
+    by default World 1-1 and a 20,000-column sparse level.
+    """
+    import random
+    import tracemalloc
+    
+    def list_of_lists(src):
+        return [[TILE_BY_ID[src.tile_id(x, y)] for x in range(src.width)] for y in range(src.height)]
+    
+    print("%-12s %-13s %12s %14s" % ("level", "store", "bytes", "ns/is_solid"))
+    if levels is None:
+        levels = (("World 1-1", lambda: create_world_1_1()[0]),
+                  ("20000 cols", lambda: sparse_test_level(20000)))
+    for name, build_level in levels:
+        src = build_level()
+        rnd = random.Random(0)
+        points = [(rnd.randrange(src.width), rnd.randrange(src.height)) for _ in range(reads)]
+        for store, build in (("list-of-lists", list_of_lists),
+                             ("TileGrid", lambda g: TileGrid.from_cells(g.width, g.height, g.cells)),
+                             ("ChunkedGrid", ChunkedGrid.from_grid)):
+            tracemalloc.start()
+            grid = build(src)
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            if store == "list-of-lists":
+                for x, y in points:
+                    grid[y][x] in SOLID_TILES
+            else:
+                is_solid = grid.is_solid
+                for x, y in points:
+                    is_solid(x, y)
+            ns = (time.perf_counter() - start) / reads * 1e9
+            print("%-12s %-13s %12d %14.0f" % (name, store, size, ns))
+            del grid
+
+# ─────────────────────────────────────────────────────────────
+# TILE COLLISION - plain integer maths against tile AABBs
+# ─────────────────────────────────────────────────────────────
+WALL_NONE = -1   # wall_hit: nothing in the way
+WALL_EDGE = -2   # wall_hit: box reached the edge of the level
+
+def wall_hit(grid, left, top, right, bottom, vx, offgrid_clear=False):
+    """Tile column a box moving horizontally at vx runs into.
+
+    Returns the column of the first solid tile on the leading edge,
+    WALL_EDGE at the level bounds, or WALL_NONE. Rows above or below the
+    grid are skipped; with offgrid_clear a box reaching past them hits no
+    wall at all (how snapping walkers drop down pits).
+    """
+    tx1 = left // TILE_SIZE
+    tx2 = right // TILE_SIZE
+    if tx1 < 0 or tx2 >= grid.width:
+        return WALL_EDGE
+    if vx == 0:
+        return WALL_NONE
+    ty1 = top // TILE_SIZE
+    ty2 = (bottom - 1) // TILE_SIZE
+    if offgrid_clear and (ty1 < 0 or ty2 >= grid.height):
+        return WALL_NONE
+    tx = tx2 if vx > 0 else tx1
+    for ty in range(max(0, ty1), min(grid.height - 1, ty2) + 1):
+        if grid.is_solid(tx, ty):
+            return tx
+    return WALL_NONE
+
+def floor_hit(grid, foot_x, bottom):
+    """Row of the solid tile under a box's bottom-centre point, or -1."""
+    tx = int(foot_x // TILE_SIZE)
+    ty = bottom // TILE_SIZE
+    if tx < 0 or tx >= grid.width or ty < 0 or ty >= grid.height:
+        return -1
+    return ty if grid.is_solid(tx, ty) else -1
+
 # ─────────────────────────────────────────────────────────────
 # AUTHENTIC SMB WORLD 1-1 LEVEL DATA
 # Each row: (tile_type, x, y) or special structure markers
@@ -709,13 +1188,13 @@ def create_world_1_1():
     H = 15
     FLOOR_Y = 13
     
-    grid = [[Tile.AIR for _ in range(W)] for _ in range(H)]
+    grid = TileGrid(W, H)
     enemies = []
     
     # Helper functions
     def set_tile(x, y, t):
         if 0 <= x < W and 0 <= y < H:
-            grid[y][x] = t
+            grid.set(x, y, t)
     
     def fill_floor(start, end):
         for x in range(start, end):
@@ -863,8 +1342,8 @@ def create_world_1_1():
             set_tile(148 + i, FLOOR_Y - 1 - j, Tile.STAIR)
     
     # Gap after staircase 2
-    grid[FLOOR_Y][152] = Tile.AIR
-    grid[FLOOR_Y+1][152] = Tile.AIR
+    grid.set(152, FLOOR_Y, Tile.AIR)
+    grid.set(152, FLOOR_Y+1, Tile.AIR)
     
     # Staircase 2 - descending (x=155-158)
     for i in range(4):
@@ -923,23 +1402,88 @@ def create_world_1_1():
     
     return grid, enemies
 
+def flag_column(grid):
+    """Column holding the flagpole top, or -1 if the level has none."""
+    for x in range(grid.width):
+        for y in range(grid.height):
+            if grid.tile_id(x, y) == Tile.FLAG_TOP.value:
+                return x
+    return -1
+
 # ─────────────────────────────────────────────────────────────
 # ENTITIES
 # ─────────────────────────────────────────────────────────────
 
 class Entity:
+    """Base for everything that moves and collides.
+
+    Every class in the hierarchy declares __slots__, so an entity is a
+    fixed record with no per-instance dict. The integer box is derived
+    from x/y where it is needed instead of mirrored into a Rect each move.
+    """
+    __slots__ = ("x", "y", "w", "h", "vx", "vy", "dead")
+    WALL_SNAP = False   # Push out of walls as well as turning around
+    FLOOR_BOUNCE = 0.0  # vy after landing
+
     def __init__(self, x, y, w, h):
         self.x, self.y = float(x), float(y)
         self.w, self.h = w, h
         self.vx, self.vy = 0.0, 0.0
         self.dead = False
-        self.rect = pygame.Rect(x, y, w, h)
 
-    def update_rect(self):
-        self.rect.x = int(self.x)
-        self.rect.y = int(self.y)
+    def clone(self):
+        """Independent copy for snapshots."""
+        return copy.copy(self)
+
+    @property
+    def rect(self):
+        """Integer bounding box as a Rect, built on demand."""
+        return pygame.Rect(int(self.x), int(self.y), self.w, self.h)
+
+    def begin_update(self, cam_x=0):
+        """Per-frame bookkeeping before physics; True if it walks this frame."""
+        return not self.dead
+
+    def end_update(self):
+        pass
+
+    def walk(self, grid):
+        """One frame of walker physics: gravity, then move and collide per axis.
+
+        WalkerPhysics.step runs exactly this for a whole batch at once.
+        """
+        self.vy += GRAVITY
+        if self.vy > MAX_FALL:
+            self.vy = MAX_FALL
+        
+        self.x += self.vx
+        self.collide_x(grid)
+        
+        self.y += self.vy
+        self.collide_y(grid)
+
+    def collide_x(self, grid):
+        """Walker wall check: turn around at walls and the level edges."""
+        left = int(self.x)
+        hit = wall_hit(grid, left, int(self.y), left + self.w, int(self.y) + self.h, self.vx,
+                       self.WALL_SNAP)
+        if hit == WALL_NONE:
+            return
+        if self.WALL_SNAP and hit >= 0:
+            self.x = (hit + 1) * TILE_SIZE if self.vx < 0 else hit * TILE_SIZE - self.w
+        self.vx *= -1
+
+    def collide_y(self, grid):
+        """Walker floor check: land on (or bounce off) the tile underfoot."""
+        ty = floor_hit(grid, self.x + self.w/2, int(self.y) + self.h)
+        if ty >= 0:
+            self.y = ty * TILE_SIZE - self.h
+            self.vy = self.FLOOR_BOUNCE
 
 class Goomba(Entity):
+    __slots__ = ("frame", "stomped", "stomp_timer", "activated")
+    WALL_SNAP = True
+
     def __init__(self, x, y):
         super().__init__(x, y, TILE_SIZE - 4*NES_PIXEL, TILE_SIZE)
         self.vx = -0.8 * NES_PIXEL
@@ -949,72 +1493,34 @@ class Goomba(Entity):
         self.activated = False
 
     def update(self, grid, cam_x):
+        if self.begin_update(cam_x):
+            self.walk(grid)
+            self.end_update()
+
+    def begin_update(self, cam_x):
         if self.dead: 
-            return
+            return False
         
         # Only activate when on screen
         if not self.activated:
             if self.x < cam_x + SCREEN_W + TILE_SIZE * 2:
                 self.activated = True
             else:
-                return
+                return False
         
         if self.stomped:
             self.stomp_timer += 1
             if self.stomp_timer > 30:
                 self.dead = True
-            return
-            
-        self.vy += GRAVITY
-        if self.vy > MAX_FALL: 
-            self.vy = MAX_FALL
-        
-        self.x += self.vx
-        self.update_rect()
-        self.collide_x(grid)
-        
-        self.y += self.vy
-        self.update_rect()
-        self.collide_y(grid)
-        
+            return False
+        return True
+
+    def end_update(self):
         self.frame += 0.15
         
         if self.y > SCREEN_H + 64: 
             self.dead = True
 
-    def collide_x(self, grid):
-        tx1 = int(self.rect.left // TILE_SIZE)
-        tx2 = int(self.rect.right // TILE_SIZE)
-        ty1 = int(self.rect.top // TILE_SIZE)
-        ty2 = int((self.rect.bottom - 1) // TILE_SIZE)
-        
-        if tx1 < 0 or tx2 >= len(grid[0]):
-            self.vx *= -1
-            return
-        if ty1 < 0 or ty2 >= len(grid):
-            return
-            
-        for ty in range(ty1, ty2 + 1):
-            if self.vx < 0 and tx1 >= 0 and grid[ty][tx1] in SOLID_TILES:
-                self.x = (tx1 + 1) * TILE_SIZE
-                self.vx *= -1
-                break
-            if self.vx > 0 and tx2 < len(grid[0]) and grid[ty][tx2] in SOLID_TILES:
-                self.x = tx2 * TILE_SIZE - self.w
-                self.vx *= -1
-                break
-
-    def collide_y(self, grid):
-        tx = int((self.x + self.w/2) // TILE_SIZE)
-        ty2 = int(self.rect.bottom // TILE_SIZE)
-        
-        if tx < 0 or tx >= len(grid[0]) or ty2 >= len(grid):
-            return
-        if grid[ty2][tx] in SOLID_TILES:
-            self.y = ty2 * TILE_SIZE - self.h
-            self.vy = 0
-            self.update_rect()
-
     def stomp(self):
         self.stomped = True
         self.vx = 0
@@ -1032,6 +1538,8 @@ class Goomba(Entity):
             surf.blit(frame, (draw_x, self.y))
 
 class Mushroom(Entity):
+    __slots__ = ("emerging", "emerge_y", "target_y", "is_1up")
+
     def __init__(self, x, y, is_1up=False):
         super().__init__(x, y, TILE_SIZE, TILE_SIZE)
         self.vx = 1.5 * NES_PIXEL
@@ -1041,63 +1549,26 @@ class Mushroom(Entity):
         self.is_1up = is_1up
 
     def update(self, grid):
+        if self.begin_update():
+            self.walk(grid)
+            self.end_update()
+
+    def begin_update(self, cam_x=0):
         if self.dead:
-            return
+            return False
             
         if self.emerging:
             self.y -= 0.5 * NES_PIXEL
             if self.y <= self.target_y:
                 self.y = self.target_y
                 self.emerging = False
-            self.update_rect()
-            return
-        
-        self.vy += GRAVITY
-        if self.vy > MAX_FALL:
-            self.vy = MAX_FALL
-        
-        self.x += self.vx
-        self.update_rect()
-        self.collide_x(grid)
-        
-        self.y += self.vy
-        self.update_rect()
-        self.collide_y(grid)
-        
+            return False
+        return True
+
+    def end_update(self):
         if self.y > SCREEN_H + 64:
             self.dead = True
 
-    def collide_x(self, grid):
-        tx1 = int(self.rect.left // TILE_SIZE)
-        tx2 = int(self.rect.right // TILE_SIZE)
-        ty1 = int(self.rect.top // TILE_SIZE)
-        ty2 = int((self.rect.bottom - 1) // TILE_SIZE)
-        
-        if tx1 < 0 or tx2 >= len(grid[0]):
-            self.vx *= -1
-            return
-            
-        for ty in range(ty1, ty2 + 1):
-            if ty < 0 or ty >= len(grid):
-                continue
-            if self.vx > 0 and grid[ty][tx2] in SOLID_TILES:
-                self.vx *= -1
-                break
-            if self.vx < 0 and grid[ty][tx1] in SOLID_TILES:
-                self.vx *= -1
-                break
-
-    def collide_y(self, grid):
-        tx = int((self.x + self.w/2) // TILE_SIZE)
-        ty2 = int(self.rect.bottom // TILE_SIZE)
-        
-        if tx < 0 or tx >= len(grid[0]) or ty2 >= len(grid):
-            return
-        if grid[ty2][tx] in SOLID_TILES:
-            self.y = ty2 * TILE_SIZE - self.h
-            self.vy = 0
-            self.update_rect()
-
     def draw(self, surf, cam_x):
         if not self.dead:
             sprite = GFX.mushroom_1up if self.is_1up else GFX.mushroom
@@ -1105,6 +1576,8 @@ class Mushroom(Entity):
 
 
 class FireFlower(Entity):
+    __slots__ = ("emerging", "emerge_y", "target_y", "anim_frame")
+
     def __init__(self, x, y):
         super().__init__(x, y, TILE_SIZE, TILE_SIZE)
         self.emerging = True
@@ -1113,17 +1586,21 @@ class FireFlower(Entity):
         self.anim_frame = 0
 
     def update(self, grid):
+        self.begin_update()
+
+    def begin_update(self, cam_x=0):
+        # Flowers never walk
         if self.dead:
-            return
+            return False
             
         if self.emerging:
             self.y -= 0.5 * NES_PIXEL
             if self.y <= self.target_y:
                 self.y = self.target_y
                 self.emerging = False
-            self.update_rect()
         
         self.anim_frame += 0.1
+        return False
 
     def draw(self, surf, cam_x):
         if not self.dead:
@@ -1131,6 +1608,9 @@ class FireFlower(Entity):
 
 
 class Starman(Entity):
+    __slots__ = ("emerging", "emerge_y", "target_y", "anim_frame")
+    FLOOR_BOUNCE = -4.0 * NES_PIXEL
+
     def __init__(self, x, y):
         super().__init__(x, y, TILE_SIZE, TILE_SIZE)
         self.vx = 2.0 * NES_PIXEL
@@ -1141,8 +1621,14 @@ class Starman(Entity):
         self.anim_frame = 0
 
     def update(self, grid):
+        # Starman bounces - see FLOOR_BOUNCE
+        if self.begin_update():
+            self.walk(grid)
+            self.end_update()
+
+    def begin_update(self, cam_x=0):
         if self.dead:
-            return
+            return False
             
         if self.emerging:
             self.y -= 0.5 * NES_PIXEL
@@ -1150,58 +1636,15 @@ class Starman(Entity):
                 self.y = self.target_y
                 self.emerging = False
                 self.vy = -4.0 * NES_PIXEL
-            self.update_rect()
-            return
-        
-        # Starman bounces!
-        self.vy += GRAVITY
-        if self.vy > MAX_FALL:
-            self.vy = MAX_FALL
-        
-        self.x += self.vx
-        self.update_rect()
-        self.collide_x(grid)
-        
-        self.y += self.vy
-        self.update_rect()
-        self.collide_y(grid)
-        
+            return False
+        return True
+
+    def end_update(self):
         self.anim_frame += 0.2
         
         if self.y > SCREEN_H + 64:
             self.dead = True
 
-    def collide_x(self, grid):
-        tx1 = int(self.rect.left // TILE_SIZE)
-        tx2 = int(self.rect.right // TILE_SIZE)
-        ty1 = int(self.rect.top // TILE_SIZE)
-        ty2 = int((self.rect.bottom - 1) // TILE_SIZE)
-        
-        if tx1 < 0 or tx2 >= len(grid[0]):
-            self.vx *= -1
-            return
-            
-        for ty in range(ty1, ty2 + 1):
-            if ty < 0 or ty >= len(grid):
-                continue
-            if self.vx > 0 and grid[ty][tx2] in SOLID_TILES:
-                self.vx *= -1
-                break
-            if self.vx < 0 and grid[ty][tx1] in SOLID_TILES:
-                self.vx *= -1
-                break
-
-    def collide_y(self, grid):
-        tx = int((self.x + self.w/2) // TILE_SIZE)
-        ty2 = int(self.rect.bottom // TILE_SIZE)
-        
-        if tx < 0 or tx >= len(grid[0]) or ty2 >= len(grid):
-            return
-        if grid[ty2][tx] in SOLID_TILES:
-            self.y = ty2 * TILE_SIZE - self.h
-            self.vy = -4.0 * NES_PIXEL  # Bounce!
-            self.update_rect()
-
     def draw(self, surf, cam_x):
         if not self.dead:
             # Flicker colors for star effect
@@ -1209,6 +1652,8 @@ class Starman(Entity):
 
 
 class FloatingCoin(Entity):
+    __slots__ = ("anim_frame", "collected")
+
     def __init__(self, x, y):
         super().__init__(x, y, TILE_SIZE, TILE_SIZE)
         self.anim_frame = 0
@@ -1217,12 +1662,21 @@ class FloatingCoin(Entity):
     def update(self):
         self.anim_frame += 0.15
 
+    def begin_update(self, cam_x=0):
+        self.update()
+        return False
+
     def draw(self, surf, cam_x):
         if not self.dead and not self.collected:
             surf.blit(GFX.coin, (self.x - cam_x, self.y))
 
 class BrickParticle:
-    def __init__(self, x, y):
+    __slots__ = ("x", "y", "vx", "vy", "dead", "size")
+
+    def __init__(self, x=0, y=0):
+        self.reset(x, y)
+
+    def reset(self, x, y):
         self.x = x
         self.y = y
         self.vx = (2 - 4 * (x % 2)) * NES_PIXEL
@@ -1242,7 +1696,12 @@ class BrickParticle:
             pygame.draw.rect(surf, C.G_MID, (self.x - cam_x, self.y, self.size, self.size))
 
 class CoinPopup:
-    def __init__(self, x, y):
+    __slots__ = ("x", "y", "start_y", "vy", "dead", "frame")
+
+    def __init__(self, x=0, y=0):
+        self.reset(x, y)
+
+    def reset(self, x, y):
         self.x = x
         self.y = y
         self.start_y = y
@@ -1262,7 +1721,12 @@ class CoinPopup:
             surf.blit(GFX.coin, (self.x - cam_x, self.y))
 
 class ScorePopup:
-    def __init__(self, x, y, score):
+    __slots__ = ("x", "y", "score", "timer", "dead")
+
+    def __init__(self, x=0, y=0, score=0):
+        self.reset(x, y, score)
+
+    def reset(self, x, y, score):
         self.x = x
         self.y = y
         self.score = score
@@ -1277,10 +1741,111 @@ class ScorePopup:
 
     def draw(self, surf, cam_x, font):
         if not self.dead:
-            text = font.render(str(self.score), True, C.WHITE)
+            text = TEXT_CACHE.render(font, str(self.score), C.WHITE)
             surf.blit(text, (self.x - cam_x, self.y))
 
+class Pool:
+    """Fixed-capacity pool of one __slots__ effect class.
+
+    Every object is allocated up front. spawn() reset()s one from the
+    free list; update() hands the ones that died back to it, compacting
+    `live` in place, so steady-state play allocates nothing. If the pool
+    is full the oldest live object is recycled. `high_water` is the most
+    objects ever live at once.
+    """
+    def __init__(self, cls, capacity):
+        self.cls = cls
+        self.capacity = capacity
+        self.free = [cls() for _ in range(capacity)]
+        self.live = []
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.live)
+
+    def __iter__(self):
+        return iter(self.live)
+
+    def spawn(self, *args):
+        obj = self.free.pop() if self.free else self.live.pop(0)
+        obj.reset(*args)
+        self.live.append(obj)
+        if len(self.live) > self.high_water:
+            self.high_water = len(self.live)
+        return obj
+
+    def update(self):
+        live = self.live
+        kept = 0
+        for obj in live:
+            obj.update()
+            if obj.dead:
+                self.free.append(obj)
+            else:
+                live[kept] = obj
+                kept += 1
+        del live[kept:]
+
+    def clear(self):
+        self.free.extend(self.live)
+        self.live.clear()
+
+    def state(self):
+        """Slot values of the live objects, for snapshots."""
+        slots = self.cls.__slots__
+        return tuple(tuple(getattr(obj, name) for name in slots) for obj in self.live)
+
+    def load(self, state):
+        """Replace the live objects with ones rebuilt from state()."""
+        self.clear()
+        for values in state:
+            obj = self.free.pop() if self.free else self.cls()
+            for name, value in zip(self.cls.__slots__, values):
+                setattr(obj, name, value)
+            self.live.append(obj)
+
+class Effects:
+    """Pooled brick debris and popups. Purely visual - never affects play."""
+    def __init__(self):
+        self.bricks = Pool(BrickParticle, 64)
+        self.coins = Pool(CoinPopup, 16)
+        self.scores = Pool(ScorePopup, 32)
+
+    def pools(self):
+        return (self.bricks, self.coins, self.scores)
+
+    def update(self):
+        for pool in self.pools():
+            pool.update()
+
+    def clear(self):
+        for pool in self.pools():
+            pool.clear()
+
+    def state(self):
+        return tuple(pool.state() for pool in self.pools())
+
+    def load(self, state):
+        for pool, pool_state in zip(self.pools(), state):
+            pool.load(pool_state)
+
+    def high_water(self):
+        """(most objects ever live at once, capacity) per pooled class."""
+        return {pool.cls.__name__: (pool.high_water, pool.capacity) for pool in self.pools()}
+
+    def draw(self, surf, cam_x, font):
+        for p in self.bricks:
+            p.draw(surf, cam_x)
+        for p in self.coins:
+            p.draw(surf, cam_x)
+        for p in self.scores:
+            p.draw(surf, cam_x, font)
+
 class Mario(Entity):
+    __slots__ = ("grounded", "facing_right", "anim_timer", "score", "coins", "lives",
+                 "big", "fire_power", "invincible", "star_power", "jump_held",
+                 "finished", "finish_timer")
+
     def __init__(self, x, y):
         super().__init__(x, y, 10 * NES_PIXEL, 14 * NES_PIXEL)
         self.grounded = False
@@ -1297,7 +1862,7 @@ class Mario(Entity):
         self.finished = False
         self.finish_timer = 0
 
-    def update(self, keys, grid, particles, popups, items):
+    def update(self, buttons, grid, effects, items):
         if self.finished:
             self.finish_timer += 1
             return
@@ -1309,15 +1874,15 @@ class Mario(Entity):
             self.star_power -= 1
         
         # Running
-        running = keys[pygame.K_LSHIFT] or keys[pygame.K_x]
+        running = buttons & Buttons.RUN
         accel = RUN_ACCEL if running else WALK_ACCEL
         max_speed = MAX_RUN if running else MAX_WALK
         
         # Input
-        if keys[pygame.K_LEFT] or keys[pygame.K_a]:
+        if buttons & Buttons.LEFT:
             self.vx -= accel
             self.facing_right = False
-        elif keys[pygame.K_RIGHT] or keys[pygame.K_d]:
+        elif buttons & Buttons.RIGHT:
             self.vx += accel
             self.facing_right = True
         else:
@@ -1335,7 +1900,7 @@ class Mario(Entity):
             self.vx = -max_speed
         
         # Jump - variable height based on hold duration
-        jump_pressed = keys[pygame.K_SPACE] or keys[pygame.K_z]
+        jump_pressed = buttons & Buttons.JUMP
         if jump_pressed and self.grounded and not self.jump_held:
             self.vy = JUMP_FORCE
             self.grounded = False
@@ -1358,76 +1923,83 @@ class Mario(Entity):
         self.x += self.vx
         if self.x < 0:
             self.x = 0
-        self.update_rect()
-        self.handle_collision(grid, True, particles, popups, items)
+        self.handle_collision(grid, True, effects, items)
         
         self.y += self.vy
-        self.update_rect()
-        self.handle_collision(grid, False, particles, popups, items)
+        self.handle_collision(grid, False, effects, items)
         
         # Fall death
         if self.y > SCREEN_H:
             self.dead = True
 
-    def handle_collision(self, grid, x_axis, particles, popups, items):
-        start_x = max(0, int(self.rect.left // TILE_SIZE))
-        end_x = min(len(grid[0])-1, int(self.rect.right // TILE_SIZE))
-        start_y = max(0, int(self.rect.top // TILE_SIZE))
-        end_y = min(len(grid)-1, int(self.rect.bottom // TILE_SIZE))
+    def handle_collision(self, grid, x_axis, effects, items):
+        # Resolve against tile AABBs arithmetically - no Rect per tile
+        w, h = self.w, self.h
+        left, top = int(self.x), int(self.y)
+        right, bottom = left + w, top + h
+        start_x = max(0, left // TILE_SIZE)
+        end_x = min(grid.width-1, right // TILE_SIZE)
+        start_y = max(0, top // TILE_SIZE)
+        end_y = min(grid.height-1, bottom // TILE_SIZE)
         
         for y in range(start_y, end_y + 1):
+            tile_top = y * TILE_SIZE
             for x in range(start_x, end_x + 1):
-                t = grid[y][x]
-                if t in SOLID_TILES:
-                    tile_rect = pygame.Rect(x*TILE_SIZE, y*TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                    if self.rect.colliderect(tile_rect):
-                        if x_axis:
-                            if self.vx > 0:
-                                self.rect.right = tile_rect.left
-                            elif self.vx < 0:
-                                self.rect.left = tile_rect.right
-                            self.x = float(self.rect.x)
-                            self.vx = 0
-                        else:
-                            if self.vy > 0:
-                                self.rect.bottom = tile_rect.top
-                                self.grounded = True
-                            elif self.vy < 0:
-                                self.rect.top = tile_rect.bottom
-                                # Block hit
-                                self.hit_block(grid, x, y, t, particles, popups, items)
-                            self.y = float(self.rect.y)
-                            self.vy = 0
-
-    def hit_block(self, grid, x, y, t, particles, popups, items):
+                if not grid.is_solid(x, y):
+                    continue
+                tile_left = x * TILE_SIZE
+                if (left >= tile_left + TILE_SIZE or right <= tile_left or
+                        top >= tile_top + TILE_SIZE or bottom <= tile_top):
+                    continue
+                if x_axis:
+                    if self.vx > 0:
+                        left = tile_left - w
+                    elif self.vx < 0:
+                        left = tile_left + TILE_SIZE
+                    right = left + w
+                    self.x = float(left)
+                    self.vx = 0
+                else:
+                    if self.vy > 0:
+                        top = tile_top - h
+                        self.grounded = True
+                    elif self.vy < 0:
+                        top = tile_top + TILE_SIZE
+                        # Block hit
+                        self.hit_block(grid, x, y, grid.get(x, y), effects, items)
+                    bottom = top + h
+                    self.y = float(top)
+                    self.vy = 0
+
+    def hit_block(self, grid, x, y, t, effects, items):
         if t == Tile.QBLOCK:
-            grid[y][x] = Tile.QBLOCK_EMPTY
+            grid.set(x, y, Tile.QBLOCK_EMPTY)
             self.coins += 1
             self.score += 200
-            popups.append(CoinPopup(x * TILE_SIZE, (y-1) * TILE_SIZE))
-            popups.append(ScorePopup(x * TILE_SIZE, (y-1) * TILE_SIZE, 200))
+            effects.coins.spawn(x * TILE_SIZE, (y-1) * TILE_SIZE)
+            effects.scores.spawn(x * TILE_SIZE, (y-1) * TILE_SIZE, 200)
         elif t == Tile.QBLOCK_MUSH:
-            grid[y][x] = Tile.QBLOCK_EMPTY
+            grid.set(x, y, Tile.QBLOCK_EMPTY)
             # Spawn mushroom if small, fire flower if big
             if self.big:
                 items.append(FireFlower(x * TILE_SIZE, y * TILE_SIZE))
             else:
                 items.append(Mushroom(x * TILE_SIZE, y * TILE_SIZE))
         elif t == Tile.QBLOCK_STAR:
-            grid[y][x] = Tile.QBLOCK_EMPTY
+            grid.set(x, y, Tile.QBLOCK_EMPTY)
             items.append(Starman(x * TILE_SIZE, y * TILE_SIZE))
         elif t == Tile.QBLOCK_1UP:
-            grid[y][x] = Tile.QBLOCK_EMPTY
+            grid.set(x, y, Tile.QBLOCK_EMPTY)
             items.append(Mushroom(x * TILE_SIZE, y * TILE_SIZE, is_1up=True))
         elif t == Tile.BRICK:
             if self.big:
-                grid[y][x] = Tile.AIR
+                grid.set(x, y, Tile.AIR)
                 self.score += 50
                 # Spawn brick particles
                 for i in range(4):
                     px = x * TILE_SIZE + (i % 2) * 8 * NES_PIXEL
                     py = y * TILE_SIZE + (i // 2) * 8 * NES_PIXEL
-                    particles.append(BrickParticle(px, py))
+                    effects.bricks.spawn(px, py)
             else:
                 # Bump animation could go here
                 self.score += 10
@@ -1445,54 +2017,880 @@ class Mario(Entity):
         
         # Select sprite
         if not self.grounded:
-            sprite = GFX.mario_jump
+            name = "mario_jump"
         elif abs(self.vx) > 0.2 * NES_PIXEL:
             self.anim_timer += abs(self.vx) * 0.15
-            frame = int(self.anim_timer) % 3
-            if frame == 0:
-                sprite = GFX.mario_run1
-            elif frame == 1:
-                sprite = GFX.mario_run2
-            else:
-                sprite = GFX.mario_run3
+            name = ("mario_run1", "mario_run2", "mario_run3")[int(self.anim_timer) % 3]
         else:
-            sprite = GFX.mario_stand
+            name = "mario_stand"
         
-        if not self.facing_right:
-            sprite = pygame.transform.flip(sprite, True, False)
-        
-        # Star power rainbow effect
+        # Star power rainbow effect - variants are pre-tinted in Assets
         if self.star_power > 0:
-            # Create color-shifted copy
-            temp = sprite.copy()
-            colors = [(255,0,0), (0,255,0), (0,0,255), (255,255,0), (255,0,255), (0,255,255)]
-            color = colors[(self.star_power // 4) % len(colors)]
-            temp.fill(color, special_flags=pygame.BLEND_ADD)
-            surf.blit(temp, (draw_x, draw_y))
+            facing = GFX.mario_star[name][(self.star_power // 4) % len(STAR_TINTS)]
         else:
-            surf.blit(sprite, (draw_x, draw_y))
+            facing = GFX.mario_frames[name]
+        surf.blit(facing[self.facing_right], (draw_x, draw_y))
 
 # ─────────────────────────────────────────────────────────────
-# GAME STATES
+# PHYSICS SYSTEM - batched walker integration
 # ─────────────────────────────────────────────────────────────
-class GameState(Enum):
-    TITLE = 0
-    MENU = 1
-    PLAYING = 2
-    GAME_OVER = 3
-    LEVEL_CLEAR = 4
-    OPTIONS = 5
+class WalkerPhysics:
+    """Runs Entity.walk for a whole batch of walkers in one pass.
+
+    Positions, velocities, sizes and the WALL_SNAP/FLOOR_BOUNCE flags are
+    gathered into parallel arrays, integrated and collided together, then
+    written back. With NumPy the batch is vectorised; without it, or for
+    batches under `numpy_min`, a flat loop over the shared tile helpers
+    is used. Both paths give the same results as Entity.walk.
+    """
+    def __init__(self, numpy_min=32):
+        self.numpy_min = numpy_min
+
+    def step(self, walkers, grid):
+        if np is not None and len(walkers) >= self.numpy_min:
+            self._step_numpy(walkers, grid)
+        else:
+            self._step_python(walkers, grid)
+
+    def _step_python(self, walkers, grid):
+        for e in walkers:
+            vy = e.vy + GRAVITY
+            if vy > MAX_FALL:
+                vy = MAX_FALL
+            
+            x = e.x + e.vx
+            left, top = int(x), int(e.y)
+            hit = wall_hit(grid, left, top, left + e.w, top + e.h, e.vx, e.WALL_SNAP)
+            if hit != WALL_NONE:
+                if e.WALL_SNAP and hit >= 0:
+                    x = (hit + 1) * TILE_SIZE if e.vx < 0 else hit * TILE_SIZE - e.w
+                e.vx *= -1
+            
+            y = e.y + vy
+            ty = floor_hit(grid, x + e.w/2, int(y) + e.h)
+            if ty >= 0:
+                y = ty * TILE_SIZE - e.h
+                vy = e.FLOOR_BOUNCE
+            e.x, e.y, e.vy = x, y, vy
+
+    def _step_numpy(self, walkers, grid):
+        n = len(walkers)
+        x = np.fromiter((e.x for e in walkers), float, n)
+        y = np.fromiter((e.y for e in walkers), float, n)
+        vx = np.fromiter((e.vx for e in walkers), float, n)
+        vy = np.fromiter((e.vy for e in walkers), float, n)
+        w = np.fromiter((e.w for e in walkers), np.int64, n)
+        h = np.fromiter((e.h for e in walkers), np.int64, n)
+        snap = np.fromiter((e.WALL_SNAP for e in walkers), bool, n)
+        bounce = np.fromiter((e.FLOOR_BOUNCE for e in walkers), float, n)
+        
+        vy = np.minimum(vy + GRAVITY, MAX_FALL)
+        
+        # Horizontal move + wall check on the leading edge
+        x = x + vx
+        left = np.trunc(x).astype(np.int64)
+        top = np.trunc(y).astype(np.int64)
+        tx1 = left // TILE_SIZE
+        tx2 = (left + w) // TILE_SIZE
+        edge = (tx1 < 0) | (tx2 >= grid.width)
+        tx = np.where(vx > 0, tx2, tx1)
+        row1 = np.maximum(top // TILE_SIZE, 0)
+        row2 = np.minimum((top + h - 1) // TILE_SIZE, grid.height - 1)
+        # Snapping walkers partly off the grid hit no walls; see wall_hit
+        offgrid = snap & ((top // TILE_SIZE < 0) | ((top + h - 1) // TILE_SIZE >= grid.height))
+        hit = np.zeros(n, bool)
+        for k in range(int((row2 - row1).max(initial=0)) + 1):
+            ty = row1 + k
+            hit |= self._solid(grid, tx, ty, ~edge & (ty <= row2))
+        wall = hit & ~edge & ~offgrid & (vx != 0)
+        x = np.where(wall & snap, np.where(vx < 0, (tx + 1) * TILE_SIZE, tx * TILE_SIZE - w), x)
+        vx = np.where(edge | wall, -vx, vx)
+        
+        # Vertical move + floor check under the bottom-centre point
+        y = y + vy
+        foot = np.floor((x + w / 2) / TILE_SIZE).astype(np.int64)
+        ty = (np.trunc(y).astype(np.int64) + h) // TILE_SIZE
+        ok = (foot >= 0) & (foot < grid.width) & (ty >= 0) & (ty < grid.height)
+        landed = self._solid(grid, foot, ty, ok)
+        y = np.where(landed, ty * TILE_SIZE - h, y)
+        vy = np.where(landed, bounce, vy)
+        
+        for e, ex, ey, evx, evy in zip(walkers, x.tolist(), y.tolist(), vx.tolist(), vy.tolist()):
+            e.x, e.y, e.vx, e.vy = ex, ey, evx, evy
+
+    @staticmethod
+    def _solid(grid, tx, ty, mask):
+        """Vectorised is_solid; entries outside mask read as not solid."""
+        tx = np.where(mask, tx, 0)
+        ty = np.where(mask, ty, 0)
+        cells = getattr(grid, "cells", None)
+        if cells is not None:
+            ids = np.frombuffer(cells, np.uint8)[ty * grid.width + tx]
+            solid = np.frombuffer(SOLID_LUT, np.uint8)[ids].astype(bool)
+        else:
+            solid = np.fromiter((grid.is_solid(a, b) for a, b in zip(tx.tolist(), ty.tolist())), bool, len(tx))
+        return solid & mask
+
+def bench_entities(n=10000, frames=3, repeats=25):
+    """Print bytes per Goomba and update cost on an n-Goomba stress level."""
+    import tracemalloc
+    width = n * 2 + 32
+    grid = TileGrid(width, 15)
+    for x in range(width):
+        grid.set(x, 13, Tile.GROUND)
+        grid.set(x, 14, Tile.GROUND)
+    tracemalloc.start()
+    goombas = [Goomba((16 + 2 * i) * TILE_SIZE, 12 * TILE_SIZE) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0] - sys.getsizeof(goombas)
+    tracemalloc.stop()
+    for e in goombas:
+        e.activated = True
+    game = Game(headless=True)
+    game.grid, game.enemies, game.items = grid, goombas, []
+    game.spawns = SpawnIndex()
+    game.index_entities()
+    
+    print("%d Goombas, %d bytes each" % (n, size // n))
+    for label, numpy_min in (("python", n + 1), ("numpy", 32)):
+        if numpy_min <= n and np is None:
+            continue
+        game.physics = physics = WalkerPhysics(numpy_min)
+        walk = full = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(frames):
+                walkers = [e for e in goombas if e.begin_update(0)]
+                physics.step(walkers, grid)
+                for e in walkers:
+                    e.end_update()
+            walk = min(walk, (time.perf_counter() - start) / frames)
+            start = time.perf_counter()
+            game.update_playing(0)
+            full = min(full, time.perf_counter() - start)
+        print("%-6s walk %5.1f ms/frame (%.2fM entities/s), whole frame %5.1f ms" % (
+            label, walk * 1000, n / walk / 1e6, full * 1000))
 
 # ─────────────────────────────────────────────────────────────
-# MENU SPRITES
+# BROAD PHASE - spatial hash keyed by tile column
 # ─────────────────────────────────────────────────────────────
-S_MARIO_SMALL_ICON = [
-    "....RRRR....",
-    "...RRRRRR...",
-    "...BBBSSB...",
-    "..BSSBSSBS..",
-    "..BSSBSSSB..",
-    "..BBSSSSBB..",
+class SpatialHash:
+    """Uniform grid of entities, bucketed by the tile columns they span.
+
+    Entities call move() after changing position; it only touches the
+    buckets when the column span actually changed. Queries return
+    entities in a deterministic order so replays stay frame-exact.
+    """
+    def __init__(self, cell=TILE_SIZE):
+        self.cell = cell
+        self.buckets = {}
+        self.spans = {}
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __contains__(self, e):
+        return e in self.spans
+
+    def _span(self, e):
+        left = int(e.x)
+        return left // self.cell, (left + e.w - 1) // self.cell
+
+    def move(self, e):
+        """Insert e, or re-bucket it if it crossed into other columns."""
+        span = self._span(e)
+        old = self.spans.get(e)
+        if old == span:
+            return
+        if old is not None:
+            self._unlink(e, old)
+        self.spans[e] = span
+        for col in range(span[0], span[1] + 1):
+            self.buckets.setdefault(col, []).append(e)
+
+    def remove(self, e):
+        old = self.spans.pop(e, None)
+        if old is not None:
+            self._unlink(e, old)
+
+    def _unlink(self, e, span):
+        for col in range(span[0], span[1] + 1):
+            bucket = self.buckets[col]
+            bucket.remove(e)
+            if not bucket:
+                del self.buckets[col]
+
+    def query_columns(self, first, last):
+        """Every entity touching tile columns first..last."""
+        found = []
+        seen = set()
+        for col in range(first, last + 1):
+            for e in self.buckets.get(col, ()):
+                if e not in seen:
+                    seen.add(e)
+                    found.append(e)
+        return found
+
+    def query_rect(self, left, top, right, bottom):
+        """Every entity whose box overlaps the given pixel rect."""
+        left, top = int(left), int(top)
+        found = []
+        for e in self.query_columns(left // self.cell, (int(right) - 1) // self.cell):
+            ex, ey = int(e.x), int(e.y)
+            if ex < right and ex + e.w > left and ey < bottom and ey + e.h > top:
+                found.append(e)
+        return found
+
+    def remap(self, clones):
+        """Copy of this hash holding clones[e] for every e, in the same bucket order."""
+        h = SpatialHash(self.cell)
+        h.buckets = {col: [clones[e] for e in bucket] for col, bucket in self.buckets.items()}
+        h.spans = {clones[e]: span for e, span in self.spans.items()}
+        return h
+
+# ─────────────────────────────────────────────────────────────
+# CHUNKED ACTIVATION - dormant entities wait in a sorted spawn index
+# ─────────────────────────────────────────────────────────────
+class SpawnIndex:
+    """Placed-but-dormant entities, sorted by x.
+
+    The camera only scrolls right, so waking entities is a cursor walk
+    along the sorted list; nothing behind the cursor is looked at again.
+    """
+    def __init__(self, entities=()):
+        self.dormant = sorted(entities, key=lambda e: e.x)
+        self.next = 0
+
+    def __len__(self):
+        return len(self.dormant) - self.next
+
+    def release_until(self, x):
+        """Hand over every dormant entity placed left of x."""
+        start = self.next
+        dormant = self.dormant
+        while self.next < len(dormant) and dormant[self.next].x < x:
+            self.next += 1
+        return dormant[start:self.next]
+
+    def clone(self):
+        """Index of clones of the entities still waiting to be released."""
+        return SpawnIndex(e.clone() for e in self.dormant[self.next:])
+
+def chunk_window(cam_x):
+    """Pixel span [left, right) of the chunks kept live around the camera.
+
+    One chunk of slack is kept behind the screen; ahead, everything up to
+    the chunk containing the Goomba activation line is awake.
+    """
+    chunk_px = CHUNK_COLS * TILE_SIZE
+    left = (cam_x // chunk_px - 1) * chunk_px
+    right = ((cam_x + SCREEN_W + TILE_SIZE * 2) // chunk_px + 1) * chunk_px
+    return left, right
+
+# ─────────────────────────────────────────────────────────────
+# LEVEL FILES - chunked binary levels, streamed in column by column
+#
+#   header   LEVEL_HEADER (magic, version, height, chunk columns,
+#            width, flag column, chunk count, spawn count)
+#   offsets  chunk count + 1 uint32 offsets into the chunk data
+#   spawns   LEVEL_SPAWN records (column, row, kind) sorted by column
+#   chunks   per chunk: column-major tile ids as (count, id) byte runs
+# ─────────────────────────────────────────────────────────────
+LEVEL_MAGIC = b"SMBL"
+LEVEL_VERSION = 1
+LEVEL_HEADER = struct.Struct("<4sBBHIiII")
+LEVEL_SPAWN = struct.Struct("<IBB")
+SPAWN_KINDS = {1: Goomba}
+SPAWN_KIND_IDS = {cls: kind for kind, cls in SPAWN_KINDS.items()}
+
+class LevelError(ValueError):
+    """A level file that cannot be read."""
+
+def encode_columns(grid, first, last):
+    """Run-length encode columns first..last-1 of grid, column-major."""
+    out = bytearray()
+    count, prev = 0, None
+    for x in range(first, last):
+        for y in range(grid.height):
+            t = grid.tile_id(x, y)
+            if t == prev and count < 255:
+                count += 1
+            else:
+                if count:
+                    out += bytes((count, prev))
+                count, prev = 1, t
+    if count:
+        out += bytes((count, prev))
+    return out
+
+def pack_spawns(spawns):
+    """Placed entities as a LEVEL_SPAWN table sorted by column."""
+    placed = sorted(spawns, key=lambda e: e.x)
+    return b"".join(LEVEL_SPAWN.pack(int(e.x) // TILE_SIZE, int(e.y) // TILE_SIZE,
+                                     SPAWN_KIND_IDS[type(e)]) for e in placed)
+
+def level_digest(width, height, flag_col, table, cells):
+    """Content hash of a level, the same whichever format it is stored in.
+
+    cells are the row-major tile ids; table is the packed spawn table.
+    """
+    h = hashlib.sha1(struct.pack("<IBi", width, height, flag_col))
+    h.update(table)
+    h.update(cells)
+    return h.digest()[:16]
+
+WORLD_1_1_DIGEST = None
+
+def world_1_1_digest():
+    global WORLD_1_1_DIGEST
+    if WORLD_1_1_DIGEST is None:
+        grid, placed = create_world_1_1()
+        WORLD_1_1_DIGEST = level_digest(grid.width, grid.height, flag_column(grid),
+                                        pack_spawns(placed), grid.cells)
+    return WORLD_1_1_DIGEST
+
+def write_level(path, grid, spawns):
+    """Write a grid and its placed entities as a streamable level file."""
+    n_chunks = (grid.width + CHUNK_COLS - 1) // CHUNK_COLS
+    offsets, data = [], bytearray()
+    for c in range(n_chunks):
+        offsets.append(len(data))
+        data += encode_columns(grid, c * CHUNK_COLS, min(grid.width, (c + 1) * CHUNK_COLS))
+    offsets.append(len(data))
+    table = pack_spawns(spawns)
+    with open(path, "wb") as f:
+        f.write(LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, grid.height, CHUNK_COLS,
+                                  grid.width, flag_column(grid), n_chunks,
+                                  len(table) // LEVEL_SPAWN.size))
+        f.write(struct.pack("<%dI" % len(offsets), *offsets))
+        f.write(table)
+        f.write(data)
+
+class LevelFile:
+    """An open level file. Only the header and tables are read up front.
+
+    grid() and spawns() hand out fresh streaming views for a new attempt;
+    chunks are read from disk as they are first touched.
+    """
+    def __init__(self, path):
+        self.path = self.source = path
+        self.file = open(path, "rb")
+        self.hash = None
+        head = self.file.read(LEVEL_HEADER.size)
+        if len(head) < LEVEL_HEADER.size:
+            raise LevelError("level truncated")
+        (magic, version, self.height, self.chunk_cols, self.width,
+         self.flag_col, n_chunks, n_spawns) = LEVEL_HEADER.unpack(head)
+        if magic != LEVEL_MAGIC:
+            raise LevelError("not a level file")
+        if version != LEVEL_VERSION:
+            raise LevelError("unsupported level version %d" % version)
+        self.offsets = self.file.read(4 * (n_chunks + 1))
+        self.spawn_table = self.file.read(LEVEL_SPAWN.size * n_spawns)
+        if len(self.offsets) != 4 * (n_chunks + 1) or len(self.spawn_table) != LEVEL_SPAWN.size * n_spawns:
+            raise LevelError("level truncated")
+        if not self.height or not self.chunk_cols or not self.width:
+            raise LevelError("level has no tiles")
+        if n_chunks != (self.width + self.chunk_cols - 1) // self.chunk_cols:
+            raise LevelError("level has %d chunks, width needs %d" % (
+                n_chunks, (self.width + self.chunk_cols - 1) // self.chunk_cols))
+        last_col = 0
+        for col, row, kind in LEVEL_SPAWN.iter_unpack(self.spawn_table):
+            if kind not in SPAWN_KINDS or col < last_col or col >= self.width or row >= self.height:
+                raise LevelError("bad spawn record at column %d" % col)
+            last_col = col
+        self.data_start = self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def read_chunk(self, c):
+        """Decode chunk c into a column-major bytearray.
+
+        Raises LevelError unless the runs decode to exactly the chunk's
+        cells, all of them known tile ids.
+        """
+        start, end = struct.unpack_from("<II", self.offsets, 4 * c)
+        if end < start:
+            raise LevelError("chunk %d has a negative length" % c)
+        self.file.seek(self.data_start + start)
+        runs = self.file.read(end - start)
+        if len(runs) != end - start:
+            raise LevelError("chunk %d truncated" % c)
+        if len(runs) % 2:
+            raise LevelError("chunk %d ends in half a run" % c)
+        cells = bytearray()
+        for i in range(0, len(runs), 2):
+            cells += bytes((runs[i + 1],)) * runs[i]
+        size = (min(self.width, (c + 1) * self.chunk_cols) - c * self.chunk_cols) * self.height
+        if len(cells) != size:
+            raise LevelError("chunk %d decodes to %d cells, expected %d" % (c, len(cells), size))
+        if bytes(cells).translate(None, TILE_ID_BYTES):
+            raise LevelError("chunk %d has unknown tile ids" % c)
+        return cells
+
+    def cells(self):
+        """All tile ids, row-major, decoding each chunk once."""
+        w, h = self.width, self.height
+        cells = bytearray(w * h)
+        for c in range(len(self.offsets) // 4 - 1):
+            x0 = c * self.chunk_cols
+            x1 = min(w, x0 + self.chunk_cols)
+            chunk = self.read_chunk(c)  # column-major
+            for y in range(h):
+                cells[y * w + x0:y * w + x1] = chunk[y::h]
+        return cells
+
+    def digest(self):
+        if self.hash is None:
+            self.hash = level_digest(self.width, self.height, self.flag_col,
+                                     self.spawn_table, self.cells())
+        return self.hash
+
+    def grid(self):
+        return StreamedGrid(self)
+
+    def spawns(self):
+        return LevelSpawns(self.spawn_table)
+
+class StreamedGrid:
+    """TileGrid interface over a LevelFile, decoding chunks on demand.
+
+    At most `max_chunks` decoded chunks are kept, dropping the ones furthest
+    from the chunk just loaded. Writes go to a sparse `overrides` dict
+    (column-major cell index -> tile id) that is re-applied whenever a chunk
+    is decoded again; freeze()/thaw() share it copy-on-write like TileGrid.
+    """
+    def __init__(self, level, max_chunks=8):
+        self.level = level
+        self.width = level.width
+        self.height = level.height
+        self.chunk_cols = level.chunk_cols
+        self.max_chunks = max_chunks
+        self.chunks = {}
+        self.overrides = {}
+        self.shared = False
+        self.listeners = []
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def load_chunk(self, c):
+        cells = self.level.read_chunk(c)
+        base = c * self.chunk_cols * self.height
+        for i, t in self.overrides.items():
+            if base <= i < base + len(cells):
+                cells[i - base] = t
+        self.chunks[c] = cells
+        while len(self.chunks) > self.max_chunks:
+            del self.chunks[max(self.chunks, key=lambda i: abs(i - c))]
+        return cells
+
+    def tile_id(self, x, y):
+        c = x // self.chunk_cols
+        cells = self.chunks.get(c)
+        if cells is None:
+            cells = self.load_chunk(c)
+        return cells[(x - c * self.chunk_cols) * self.height + y]
+
+    def get(self, x, y):
+        return TILE_BY_ID[self.tile_id(x, y)]
+
+    def is_solid(self, x, y):
+        return SOLID_LUT[self.tile_id(x, y)]
+
+    def set(self, x, y, tile):
+        if self.shared:
+            self.overrides = dict(self.overrides)
+            self.shared = False
+        self.overrides[x * self.height + y] = tile.value
+        c = x // self.chunk_cols
+        cells = self.chunks.get(c)
+        if cells is not None:
+            cells[(x - c * self.chunk_cols) * self.height + y] = tile.value
+        for fn in self.listeners:
+            fn(x, y)
+
+    def freeze(self):
+        self.shared = True
+        return self.overrides
+
+    def thaw(self, overrides):
+        old, self.overrides, self.shared = self.overrides, overrides, True
+        if old is overrides:
+            return
+        changed = [i for i in old.keys() | overrides.keys() if old.get(i) != overrides.get(i)]
+        for i in changed:
+            self.chunks.pop(i // self.height // self.chunk_cols, None)
+        for i in sorted(changed):
+            for fn in self.listeners:
+                fn(i // self.height, i % self.height)
+
+class LevelSpawns:
+    """SpawnIndex over a level's packed spawn table.
+
+    Entities are only constructed as the camera releases them.
+    """
+    def __init__(self, table, next=0):
+        self.table = table
+        self.next = next
+
+    def __len__(self):
+        return len(self.table) // LEVEL_SPAWN.size - self.next
+
+    def release_until(self, x):
+        released = []
+        table = self.table
+        while (self.next + 1) * LEVEL_SPAWN.size <= len(table):
+            col, row, kind = LEVEL_SPAWN.unpack_from(table, self.next * LEVEL_SPAWN.size)
+            if col * TILE_SIZE >= x:
+                break
+            released.append(SPAWN_KINDS[kind](col * TILE_SIZE, row * TILE_SIZE))
+            self.next += 1
+        return released
+
+    def clone(self):
+        return LevelSpawns(self.table, self.next)
+
+class ChunkedLevel(LevelFile):
+    """LevelFile decoded once, up front, into deduplicated chunks.
+
+    Every attempt gets a ChunkedGrid over the same frozen chunks, so a long
+    sparse level costs one copy of each distinct chunk however many times
+    it is restarted, snapshotted or rewound; writes only copy the chunk
+    they touch.
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        if self.chunk_cols != CHUNK_COLS:
+            raise LevelError("chunked tiles need %d-column chunks, file has %d"
+                             % (CHUNK_COLS, self.chunk_cols))
+        grid = ChunkedGrid(self.width, self.height)
+        size = CHUNK_COLS * self.height
+        for c in range(len(grid.chunks)):
+            cells = self.read_chunk(c)
+            grid.chunks[c] = cells + bytes([Tile.AIR.value]) * (size - len(cells))
+        grid.compact()
+        self.chunks = grid.freeze()
+
+    def grid(self):
+        grid = ChunkedGrid(self.width, self.height)
+        grid.thaw(self.chunks)
+        return grid
+
+# ─────────────────────────────────────────────────────────────
+# COMPILED LEVELS - tile ids memory-mapped straight from disk
+#
+#   header   COMPILED_HEADER (magic, version, height, width, flag column,
+#            spawn count, tile offset)
+#   spawns   LEVEL_SPAWN records sorted by column
+#   tiles    width * height uint8 ids, row-major like TileGrid.cells,
+#            starting at an mmap-aligned offset
+# ─────────────────────────────────────────────────────────────
+COMPILED_MAGIC = b"SMBC"
+COMPILED_VERSION = 1
+COMPILED_HEADER = struct.Struct("<4sBBIiII")
+
+def write_compiled(path, width, height, flag_col, table, cells):
+    """Write a compiled level from a packed spawn table and row-major cells."""
+    if len(cells) != width * height or len(table) % LEVEL_SPAWN.size:
+        raise LevelError("compiled level would be malformed")
+    align = mmap.ALLOCATIONGRANULARITY
+    tile_offset = (COMPILED_HEADER.size + len(table) + align - 1) // align * align
+    # Write under a temp name so other processes never map half a file
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(tmp, "wb") as f:
+        f.write(COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, height, width,
+                                     flag_col, len(table) // LEVEL_SPAWN.size, tile_offset))
+        f.write(table)
+        f.write(bytes(tile_offset - COMPILED_HEADER.size - len(table)))
+        f.write(cells)
+    os.replace(tmp, path)
+
+def compile_level(path, grid, spawns):
+    """Write an in-memory grid and its placed entities as a compiled level."""
+    write_compiled(path, grid.width, grid.height, flag_column(grid), pack_spawns(spawns), grid.cells)
+
+def compile_level_file(path, level):
+    """Compile an open LevelFile, decoding each chunk exactly once.
+
+    The spawn table and flag column are copied from the level file as is.
+    """
+    write_compiled(path, level.width, level.height, level.flag_col, level.spawn_table, level.cells())
+
+class CompiledLevel:
+    """A compiled level, mapped read-only. Opening costs the same at any size.
+
+    Every process mapping the file shares one page-cached copy of it;
+    grid() and spawns() give out fresh views for a new attempt, like
+    LevelFile.
+    """
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source or path  # level file it was compiled from, if known
+        self.file = open(path, "rb")
+        self.hash = None
+        head = self.file.read(COMPILED_HEADER.size)
+        if len(head) < COMPILED_HEADER.size:
+            raise LevelError("compiled level truncated")
+        (magic, version, self.height, self.width, self.flag_col,
+         n_spawns, self.tile_offset) = COMPILED_HEADER.unpack(head)
+        if magic != COMPILED_MAGIC:
+            raise LevelError("not a compiled level")
+        if version != COMPILED_VERSION:
+            raise LevelError("unsupported compiled level version %d" % version)
+        size = self.width * self.height
+        if (not size or self.tile_offset % mmap.ALLOCATIONGRANULARITY
+                or COMPILED_HEADER.size + LEVEL_SPAWN.size * n_spawns > self.tile_offset):
+            raise LevelError("compiled level header is malformed")
+        if os.fstat(self.file.fileno()).st_size < self.tile_offset + size:
+            raise LevelError("compiled level truncated")
+        head_map = mmap.mmap(self.file.fileno(), self.tile_offset, access=mmap.ACCESS_READ)
+        self.spawn_table = memoryview(head_map)[COMPILED_HEADER.size:
+                                                COMPILED_HEADER.size + LEVEL_SPAWN.size * n_spawns]
+        self.tiles = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ,
+                               offset=self.tile_offset)
+
+    def close(self):
+        self.file.close()
+
+    def map_tiles(self):
+        """Private copy-on-write mapping of the tiles."""
+        return mmap.mmap(self.file.fileno(), self.width * self.height,
+                         access=mmap.ACCESS_COPY, offset=self.tile_offset)
+
+    def digest(self):
+        if self.hash is None:
+            self.hash = level_digest(self.width, self.height, self.flag_col,
+                                     self.spawn_table, self.tiles)
+        return self.hash
+
+    def grid(self):
+        return MappedGrid(self)
+
+    def spawns(self):
+        return LevelSpawns(self.spawn_table)
+
+class MappedGrid(TileGrid):
+    """TileGrid whose cells are a copy-on-write mapping of a CompiledLevel.
+
+    Reads go straight to the shared pages; set() only makes the page it
+    touches private to this process. Writes are also kept in a sparse
+    `overrides` dict, which freeze()/thaw() hand to snapshots
+    copy-on-write instead of copying the whole level.
+    """
+    def __init__(self, level):
+        self.width = level.width
+        self.height = level.height
+        self.base = level.tiles
+        self.cells = level.map_tiles()
+        self.overrides = {}
+        self.shared = False
+        self.listeners = []
+
+    def set(self, x, y, tile):
+        if self.shared:
+            self.overrides = dict(self.overrides)
+            self.shared = False
+        i = y * self.width + x
+        self.overrides[i] = self.cells[i] = tile.value
+        for fn in self.listeners:
+            fn(x, y)
+
+    def freeze(self):
+        self.shared = True
+        return self.overrides
+
+    def thaw(self, overrides):
+        old, self.overrides, self.shared = self.overrides, overrides, True
+        if old is overrides:
+            return
+        changed = sorted(i for i in old.keys() | overrides.keys() if old.get(i) != overrides.get(i))
+        for i in changed:
+            self.cells[i] = overrides.get(i, self.base[i])
+        for i in changed:
+            for fn in self.listeners:
+                fn(i % self.width, i // self.width)
+
+# Cache paths being compiled by this process's background threads
+COMPILING = set()
+COMPILING_LOCK = threading.Lock()
+
+def compile_cached(source, path):
+    """Compile source into the cache path.
+
+    Cache write failures are ignored, as are malformed levels: those never
+    reach the cache, and playing them raises LevelError where it happens.
+    """
+    try:
+        level = LevelFile(source)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compile_level_file(path, level)
+        finally:
+            level.close()
+    except (OSError, LevelError):
+        pass
+    finally:
+        with COMPILING_LOCK:
+            COMPILING.discard(path)
+
+def load_compiled_level(source, cache_dir=None):
+    """CompiledLevel for a level file from the cache.
+
+    On a miss the level file is streamed straight away and compiled into
+    the cache on a background thread (one per cache path at a time), so
+    only the next run maps it. A damaged cache entry is deleted and
+    compiled again.
+    """
+    st = os.stat(source)
+    key = hashlib.sha1(("v%d %s %d %d" % (COMPILED_VERSION, os.path.abspath(source),
+                                          st.st_mtime_ns, st.st_size)).encode()).hexdigest()[:16]
+    cache_dir = cache_dir or sprite_cache_dir()
+    path = os.path.join(cache_dir, "level-%s.smbc" % key)
+    if os.path.exists(path):
+        try:
+            return CompiledLevel(path, source)
+        except (OSError, ValueError):  # LevelError, or an mmap that cannot be made
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    with COMPILING_LOCK:
+        start = path not in COMPILING
+        COMPILING.add(path)
+    if start:
+        threading.Thread(target=compile_cached, args=(source, path), name="compile-level").start()
+    return LevelFile(source)
+
+# How a level file's tiles are held while playing; see open_level()
+TILE_STORES = ("mapped", "chunked", "stream")
+
+def open_level(path, tiles="mapped"):
+    """Open a level to play.
+
+    A compiled (.smbc) level is always mapped. A level file is mapped
+    through the compile cache ("mapped"), decoded once into shared,
+    deduplicated chunks ("chunked" - smallest for long sparse levels) or
+    streamed from disk a few chunks at a time ("stream").
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic == COMPILED_MAGIC:
+        return CompiledLevel(path)
+    if tiles == "chunked":
+        return ChunkedLevel(path)
+    if tiles == "stream":
+        return LevelFile(path)
+    return load_compiled_level(path)
+
+# ─────────────────────────────────────────────────────────────
+# LEVEL RENDERER - cached column chunks of pre-drawn tiles
+# ─────────────────────────────────────────────────────────────
+def tile_sprite_table():
+    """Tile -> GFX sprite used to draw it (AIR has none)."""
+    return {
+        Tile.GROUND: GFX.tile_ground, Tile.BRICK: GFX.tile_brick,
+        Tile.QBLOCK: GFX.tile_q, Tile.QBLOCK_MUSH: GFX.tile_q,
+        Tile.QBLOCK_STAR: GFX.tile_q, Tile.QBLOCK_1UP: GFX.tile_q,
+        Tile.QBLOCK_EMPTY: GFX.tile_q_off, Tile.STAIR: GFX.tile_stair,
+        Tile.PIPE_TL: GFX.pipe_tl, Tile.PIPE_TR: GFX.pipe_tr,
+        Tile.PIPE_L: GFX.pipe_l, Tile.PIPE_R: GFX.pipe_r,
+        Tile.FLAG_POLE: GFX.flag_pole, Tile.FLAG_TOP: GFX.flag_top,
+        Tile.CASTLE: GFX.castle, Tile.COIN: GFX.coin,
+    }
+
+class LevelRenderer:
+    """Draws the tile grid from pre-rendered CHUNK_COLS-wide surfaces.
+
+    A chunk is painted once (sky plus tiles) and reused every frame until
+    the grid reports a change in it; then only the changed cell is
+    repainted. At most `max_chunks` chunks are kept, evicting the ones
+    furthest from the camera, so memory stays flat on long levels.
+    """
+    def __init__(self, max_chunks=4):
+        self.max_chunks = max_chunks
+        self.sprites = tile_sprite_table()
+        self.grid = None
+        self.chunks = {}
+        self.dirty = []
+
+    def attach(self, grid):
+        if self.grid is not None and self.invalidate in self.grid.listeners:
+            self.grid.listeners.remove(self.invalidate)
+        self.grid = grid
+        self.chunks = {}
+        self.dirty = []
+        grid.listeners.append(self.invalidate)
+
+    def invalidate(self, x, y):
+        if x // CHUNK_COLS in self.chunks:
+            self.dirty.append((x, y))
+
+    def paint_cell(self, surf, x, y, ox):
+        rect = (x * TILE_SIZE - ox, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+        surf.fill(C.SKY, rect)
+        sprite = self.sprites.get(self.grid.get(x, y))
+        if sprite:
+            surf.blit(sprite, rect)
+
+    def build_chunk(self, index):
+        grid = self.grid
+        surf = pygame.Surface((CHUNK_COLS * TILE_SIZE, grid.height * TILE_SIZE))
+        if pygame.display.get_surface() is not None:
+            surf = surf.convert()
+        surf.fill(C.SKY)
+        ox = index * CHUNK_COLS * TILE_SIZE
+        for x in range(ox // TILE_SIZE, min(grid.width, (index + 1) * CHUNK_COLS)):
+            for y in range(grid.height):
+                sprite = self.sprites.get(grid.get(x, y))
+                if sprite:
+                    surf.blit(sprite, (x * TILE_SIZE - ox, y * TILE_SIZE))
+        return surf
+
+    def draw(self, screen, grid, cam_x):
+        if grid is not self.grid:
+            self.attach(grid)
+        
+        chunk_px = CHUNK_COLS * TILE_SIZE
+        for x, y in self.dirty:
+            surf = self.chunks.get(x // CHUNK_COLS)
+            if surf is not None:
+                self.paint_cell(surf, x, y, x // CHUNK_COLS * chunk_px)
+        self.dirty = []
+        
+        first = cam_x // chunk_px
+        last = min((grid.width - 1) // CHUNK_COLS, (cam_x + SCREEN_W - 1) // chunk_px)
+        for index in range(first, last + 1):
+            surf = self.chunks.get(index)
+            if surf is None:
+                surf = self.chunks[index] = self.build_chunk(index)
+            screen.blit(surf, (index * chunk_px - cam_x, 0))
+        
+        while len(self.chunks) > self.max_chunks:
+            far = max(self.chunks, key=lambda i: abs(i - first))
+            del self.chunks[far]
+
+# ─────────────────────────────────────────────────────────────
+# GAME STATES
+# ─────────────────────────────────────────────────────────────
+class GameState(Enum):
+    TITLE = 0
+    MENU = 1
+    PLAYING = 2
+    GAME_OVER = 3
+    LEVEL_CLEAR = 4
+    OPTIONS = 5
+
+# ─────────────────────────────────────────────────────────────
+# MENU SPRITES
+# ─────────────────────────────────────────────────────────────
+S_MARIO_SMALL_ICON = [
+    "....RRRR....",
+    "...RRRRRR...",
+    "...BBBSSB...",
+    "..BSSBSSBS..",
+    "..BSSBSSSB..",
+    "..BBSSSSBB..",
     "....SSSSS...",
     "...RRSRRS...",
     "..RRRSSRRR..",
@@ -1540,27 +2938,700 @@ S_CURSOR = [
 # Logo letters - "SUPER" and "MARIO BROS"
 LOGO_PALETTE = {'R': C.M_RED, 'W': C.WHITE, 'Y': C.COIN_I, 'B': C.BLACK, 'O': C.COIN_O}
 
+# ─────────────────────────────────────────────────────────────
+# SPRITE TABLE - everything baked into the atlas, by GFX name
+# ─────────────────────────────────────────────────────────────
+SPRITE_TABLE = [
+    ("mario_stand", S_MARIO_STAND, MARIO_PALETTE),
+    ("mario_run1", S_MARIO_RUN1, MARIO_PALETTE),
+    ("mario_run2", S_MARIO_RUN2, MARIO_PALETTE),
+    ("mario_run3", S_MARIO_RUN3, MARIO_PALETTE),
+    ("mario_jump", S_MARIO_JUMP, MARIO_PALETTE),
+    
+    ("goomba1", S_GOOMBA1, GOOMBA_PALETTE),
+    ("goomba2", S_GOOMBA2, GOOMBA_PALETTE),
+    ("goomba_flat", S_GOOMBA_FLAT, GOOMBA_PALETTE),
+    
+    ("koopa1", S_KOOPA1, KOOPA_PALETTE),
+    
+    ("tile_ground", TILE_GROUND, TILE_PALETTE),
+    ("tile_brick", TILE_BRICK, TILE_PALETTE),
+    ("tile_q", TILE_QBLOCK, TILE_PALETTE),
+    ("tile_q_off", TILE_QBLOCK_OFF, TILE_PALETTE),
+    ("tile_stair", TILE_STAIR, TILE_PALETTE),
+    
+    ("pipe_tl", TILE_PIPE_TL, TILE_PALETTE),
+    ("pipe_tr", TILE_PIPE_TR, TILE_PALETTE),
+    ("pipe_l", TILE_PIPE_L, TILE_PALETTE),
+    ("pipe_r", TILE_PIPE_R, TILE_PALETTE),
+    
+    ("flag_pole", TILE_FLAG_POLE, TILE_PALETTE),
+    ("flag_top", TILE_FLAG_TOP, TILE_PALETTE),
+    ("flag", TILE_FLAG, TILE_PALETTE),
+    ("castle", TILE_CASTLE, TILE_PALETTE),
+    
+    ("coin", S_COIN, TILE_PALETTE),
+    ("mushroom", S_MUSHROOM, MUSH_PALETTE),
+    ("mushroom_1up", S_MUSHROOM_1UP, MUSH_PALETTE),
+    ("fireflower", S_FIREFLOWER, FLOWER_PALETTE),
+    ("starman", S_STARMAN, STAR_PALETTE),
+    
+    # Menu sprites
+    ("cursor", S_CURSOR, MARIO_PALETTE),
+    ("mario_icon", S_MARIO_SMALL_ICON, MARIO_PALETTE),
+    ("mush_icon", S_MUSHROOM_ICON, MUSH_PALETTE),
+]
+
+# ─────────────────────────────────────────────────────────────
+# INPUT
+# ─────────────────────────────────────────────────────────────
+class Buttons(IntFlag):
+    """One frame of gameplay input as a bitmask - what replays store."""
+    LEFT = 1
+    RIGHT = 2
+    RUN = 4
+    JUMP = 8
+
+    @staticmethod
+    def from_keys(keys):
+        """Fold pygame.key.get_pressed() (or any key -> bool mapping) into an int mask."""
+        mask = 0
+        if keys[pygame.K_LEFT] or keys[pygame.K_a]:
+            mask |= Buttons.LEFT
+        if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
+            mask |= Buttons.RIGHT
+        if keys[pygame.K_LSHIFT] or keys[pygame.K_x]:
+            mask |= Buttons.RUN
+        if keys[pygame.K_SPACE] or keys[pygame.K_z]:
+            mask |= Buttons.JUMP
+        return int(mask)
+
+# ─────────────────────────────────────────────────────────────
+# REPLAYS - run-length encoded per-frame button masks
+# ─────────────────────────────────────────────────────────────
+REPLAY_MAGIC = b"SMBR"
+REPLAY_VERSION = 2
+# magic, version, world, stage, start lives, finished, score, time left, frames, runs,
+# level digest, level name length; the UTF-8 level name follows the header
+REPLAY_HEADER = struct.Struct("<4sBBBBBIhII16sH")
+# Version 1 had no level fields; those replays are all of World 1-1
+REPLAY_HEADER_V1 = struct.Struct("<4sBBBBBIhII")
+
+class ReplayError(ValueError):
+    pass
+
+class Replay:
+    """Frame-exact input recording of one run from a fresh stage.
+
+    `frames` holds one Buttons mask per simulated PLAYING frame. The
+    claimed outcome (score, time, finished) is stored alongside so a
+    verifier can re-simulate and compare, as is the digest of the level
+    it was played on. On disk the masks are written as (count, mask)
+    runs - held buttons compress to a few bytes.
+    """
+    def __init__(self, world=1, stage=1, start_lives=3, level_digest=None, level_name=""):
+        self.world = world
+        self.stage = stage
+        self.start_lives = start_lives
+        self.level_digest = level_digest or world_1_1_digest()
+        # File name of the level, for messages only; levels are found by digest
+        self.level_name = level_name
+        self.frames = bytearray()
+        self.score = 0
+        self.time = 0
+        self.finished = False
+
+    def __len__(self):
+        return len(self.frames)
+
+    def record(self, buttons):
+        self.frames.append(buttons)
+
+    def claim(self, game):
+        """Store game's outcome as this replay's claimed result."""
+        self.score = game.mario.score
+        self.time = game.time
+        self.finished = game.mario.finished
+
+    def runs(self):
+        runs = []
+        for mask in self.frames:
+            if runs and runs[-1][1] == mask and runs[-1][0] < 255:
+                runs[-1][0] += 1
+            else:
+                runs.append([1, mask])
+        return runs
+
+    def to_bytes(self):
+        runs = self.runs()
+        body = bytearray()
+        for count, mask in runs:
+            body.append(count)
+            body.append(mask)
+        level_name = self.level_name.encode()
+        header = REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.world, self.stage,
+                                    self.start_lives, self.finished, self.score, self.time,
+                                    len(self.frames), len(runs), self.level_digest,
+                                    len(level_name))
+        return header + level_name + bytes(body)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < REPLAY_HEADER_V1.size:
+            raise ReplayError("replay truncated")
+        (magic, version, world, stage, lives, finished,
+         score, time, n_frames, n_runs) = REPLAY_HEADER_V1.unpack_from(data)
+        if magic != REPLAY_MAGIC:
+            raise ReplayError("not a replay file")
+        if version == 1:
+            digest, level_name, body = None, "", data[REPLAY_HEADER_V1.size:]
+        elif version == REPLAY_VERSION:
+            if len(data) < REPLAY_HEADER.size:
+                raise ReplayError("replay truncated")
+            digest, path_len = REPLAY_HEADER.unpack_from(data)[-2:]
+            body_start = REPLAY_HEADER.size + path_len
+            level_name = bytes(data[REPLAY_HEADER.size:body_start]).decode("utf-8", "replace")
+            body = data[body_start:]
+        else:
+            raise ReplayError("unsupported replay version %d" % version)
+        if len(body) != 2 * n_runs:
+            raise ReplayError("replay body size mismatch")
+        replay = cls(world, stage, lives, digest, level_name)
+        for i in range(0, len(body), 2):
+            replay.frames += bytes((body[i + 1],)) * body[i]
+        if len(replay.frames) != n_frames:
+            raise ReplayError("replay frame count mismatch")
+        replay.score, replay.time, replay.finished = score, time, bool(finished)
+        return replay
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+# Per process: trusted level sources -> {digest: path}, and levels opened
+# for replays by digest (at most OPEN_LEVELS_MAX, least recently used out)
+LEVEL_INDEXES = {}
+OPEN_LEVELS = OrderedDict()
+OPEN_LEVELS_MAX = 16
+
+def level_index(sources):
+    """{digest: path} of the level files found in sources.
+
+    sources are trusted level files and directories of them; files that
+    cannot be read are left out. Indexed once per process.
+    """
+    sources = tuple(sources)
+    index = LEVEL_INDEXES.get(sources)
+    if index is not None:
+        return index
+    index = LEVEL_INDEXES[sources] = {}
+    for source in sources:
+        if os.path.isdir(source):
+            paths = [os.path.join(source, name) for name in sorted(os.listdir(source))
+                     if name.endswith((".smbl", ".smbc"))]
+        else:
+            paths = [source]
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    compiled = f.read(4) == COMPILED_MAGIC
+                level = CompiledLevel(path) if compiled else LevelFile(path)
+                index.setdefault(level.digest(), path)
+                level.close()
+            except (OSError, LevelError):
+                pass
+    return index
+
+def replay_level(replay, sources=()):
+    """Open the level a replay was recorded on, or None for World 1-1.
+
+    The level is looked up by the replay's digest among the trusted level
+    files and directories in sources; nothing the replay names is opened.
+    Raises ReplayError when no trusted level matches.
+    """
+    digest = replay.level_digest
+    if digest == world_1_1_digest():
+        return None
+    level = OPEN_LEVELS.get(digest)
+    if level is not None:
+        OPEN_LEVELS.move_to_end(digest)
+        return level
+    path = level_index(sources).get(digest)
+    if path is None:
+        raise ReplayError("level %s (%s) is not among the trusted levels"
+                          % (replay.level_name or "?", digest.hex()))
+    try:
+        level = open_level(path)
+    except (OSError, LevelError) as e:
+        raise ReplayError("cannot open level %s: %s" % (path, e))
+    level.hash = digest  # level_index() just hashed this file
+    OPEN_LEVELS[digest] = level
+    if len(OPEN_LEVELS) > OPEN_LEVELS_MAX:
+        OPEN_LEVELS.popitem(last=False)[1].close()
+    return level
+
+def play_replay(replay, game=None, sources=()):
+    """Re-simulate a replay headlessly through Game.step; returns the Game."""
+    game = game or Game(headless=True, level=replay_level(replay, sources))
+    game.start_lives = replay.start_lives
+    game.start_game()
+    game.advance(len(replay.frames), replay.frames)
+    return game
+
+@dataclass
+class VerifyResult:
+    """Outcome of re-simulating one replay file against its claim."""
+    path: str
+    ok: bool
+    score: int = 0
+    time: int = 0
+    finished: bool = False
+    frames: int = 0
+    seconds: float = 0.0
+    error: str = ""
+
+def verify_replay(path, sources=()):
+    """Process-pool worker: load, re-simulate on a fresh world and compare.
+
+    A replay or level that cannot be read is a FAIL result, never an
+    exception, so one bad file cannot abort the rest of a batch.
+    """
+    start = time.perf_counter()
+    try:
+        replay = Replay.load(path)
+        game = play_replay(replay, sources=sources)
+    except (OSError, ReplayError, LevelError) as e:
+        return VerifyResult(path, False, error=str(e))
+    mario = game.mario
+    mismatch = [name for name, got, want in (("score", mario.score, replay.score),
+                                              ("time", game.time, replay.time),
+                                              ("finished", mario.finished, replay.finished))
+                if got != want]
+    return VerifyResult(path, not mismatch, mario.score, game.time, mario.finished,
+                        len(replay.frames), time.perf_counter() - start,
+                        "mismatch: " + ", ".join(mismatch) if mismatch else "")
+
+def verify_replays(paths, workers=None, sources=()):
+    """Verify replay files across a process pool.
+
+    Returns (results, stats); results keep the order of paths. Each worker
+    builds its own Game, so nothing is shared between processes and
+    throughput scales with the number of cores. Custom levels are looked
+    up by digest among sources, the trusted level files and directories;
+    each worker indexes them and opens a level once.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1 or len(paths) < 2:
+        results = [verify_replay(p, sources) for p in paths]
+    else:
+        chunk = max(1, len(paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(partial(verify_replay, sources=tuple(sources)),
+                                    paths, chunksize=chunk))
+    wall = time.perf_counter() - start
+    frames = sum(r.frames for r in results)
+    stats = {
+        "runs": len(results),
+        "passed": sum(r.ok for r in results),
+        "failed": sum(not r.ok for r in results),
+        "workers": workers,
+        "frames": frames,
+        "seconds": wall,
+        "runs_per_hour": len(results) / wall * 3600 if wall else 0.0,
+        "frames_per_second": frames / wall if wall else 0.0,
+    }
+    return results, stats
+
+def replay_files(paths):
+    """Expand directories into the *.smbr files they contain."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".smbr"):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+# ─────────────────────────────────────────────────────────────
+# SNAPSHOTS - savestates with a copy-on-write tile grid
+# ─────────────────────────────────────────────────────────────
+def copy_world(src, dst):
+    """Clone the entities of src onto dst; works Game -> Snapshot and back.
+
+    The spatial hashes are remapped rather than rebuilt so their bucket
+    order, and therefore every query after a restore, matches the original.
+    """
+    clones = {}
+    def clone(e):
+        c = clones[e] = e.clone()
+        return c
+    dst.mario = src.mario.clone()
+    dst.enemies = [clone(e) for e in src.enemies]
+    dst.items = [clone(it) for it in src.items]
+    dst.enemy_hash = src.enemy_hash.remap(clones)
+    dst.item_hash = src.item_hash.remap(clones)
+    dst.spawns = src.spawns.clone()
+
+class Snapshot:
+    """Frozen simulation state of a Game, taken between two steps.
+
+    Holds clones of every entity, the live effects' slot values and the
+    grid's frozen cells, which are shared with the live grid and with
+    other snapshots until a block changes. Restoring clones again, so a
+    snapshot can be restored any number of times. Menus, recording and
+    playback are not part of it.
+    """
+    FIELDS = ("state", "frame", "cam_x", "target_cam", "game_over", "time",
+              "time_tick", "flag_y", "world", "stage")
+
+    def __init__(self, game):
+        self.values = tuple(getattr(game, name) for name in self.FIELDS)
+        self.cells = game.grid.freeze()
+        self.effects = game.effects.state()
+        copy_world(game, self)
+
+    def restore(self, game):
+        for name, value in zip(self.FIELDS, self.values):
+            setattr(game, name, value)
+        game.grid.thaw(self.cells)
+        game.effects.load(self.effects)
+        copy_world(self, game)
+
+# ─────────────────────────────────────────────────────────────
+# REWIND - keyframe snapshots plus per-frame input deltas
+# ─────────────────────────────────────────────────────────────
+class RewindBuffer:
+    """The last `seconds` of PLAYING frames, ready to be stepped back through.
+
+    Every `keyframe_every` frames a Snapshot is taken; the frames between
+    keyframes are stored as their one-byte button masks. Since step() is
+    deterministic, the state at any frame is its keyframe re-simulated
+    with the masks that followed, which captures positions, velocities
+    and block changes exactly. Old segments are dropped from the front,
+    so at most seconds * FPS / keyframe_every + 1 snapshots are ever held.
+
+    Re-simulating a segment snapshots every frame it passes through into
+    `trail`, so holding rewind re-steps each segment once and then moves
+    back a frame at a time by restoring the next trail snapshot.
+    """
+    def __init__(self, seconds=30, keyframe_every=30):
+        self.capacity = seconds * FPS
+        self.keyframe_every = keyframe_every
+        self.segments = deque()  # (Snapshot, bytearray of masks stepped after it)
+        self.frames = 0
+        self.trail = []  # trail[i]: state after i masks of the last segment
+
+    def __len__(self):
+        return self.frames
+
+    def clear(self):
+        self.segments.clear()
+        self.trail = []
+        self.frames = 0
+
+    def push(self, game, buttons):
+        """Call before game.step(buttons) to make that step rewindable."""
+        if not self.segments or len(self.segments[-1][1]) >= self.keyframe_every:
+            self.segments.append((game.snapshot(), bytearray()))
+            self.trail = []
+        self.segments[-1][1].append(buttons)
+        self.frames += 1
+        while len(self.segments) > 1 and self.frames - len(self.segments[0][1]) >= self.capacity:
+            self.frames -= len(self.segments.popleft()[1])
+
+    def rewind(self, game, frames=1):
+        """Put game back `frames` steps (as far as the buffer reaches).
+
+        Returns the number of frames actually rewound; the buffer forgets
+        them, so play resumes from there.
+        """
+        frames = min(frames, self.frames)
+        if frames <= 0:
+            return 0
+        target = self.frames - frames
+        while self.frames - len(self.segments[-1][1]) > target:
+            self.frames -= len(self.segments.pop()[1])
+            self.trail = []
+        snapshot, masks = self.segments[-1]
+        keep = target - (self.frames - len(masks))
+        del masks[keep:]
+        self.frames = target
+        if keep < len(self.trail):
+            self.trail[keep].restore(game)
+            del self.trail[keep + 1:]
+            return frames
+        snapshot.restore(game)
+        self.trail = [snapshot]
+        for mask in masks:
+            game.step(mask)
+            self.trail.append(game.snapshot())
+        return frames
+
+
+# ─────────────────────────────────────────────────────────────
+# PROFILING - per-phase frame timings in ring buffers
+# ─────────────────────────────────────────────────────────────
+# Frame phases in the order run() passes through them. "enemies" includes
+# the batched walker physics, which moves items too; "world" is camera,
+# timers, pruning and rewind bookkeeping; "ui" is the HUD, menus and overlay.
+PROFILE_PHASES = ("input", "mario", "enemies", "items", "effects", "world",
+                  "tiles", "sprites", "ui", "flip")
+
+class FrameProfiler:
+    """Opt-in frame profiler: lap() charges the time since the previous lap
+    to a phase of the current frame.
+
+    Each phase (and the frame total) is a preallocated array used as a ring
+    buffer of the last `capacity` frames, so recording costs one clock read
+    and one float store per lap. Phases hit several times in a frame - the
+    simulation catching up - accumulate.
+    """
+    def __init__(self, capacity=600, refresh=30):
+        self.capacity = capacity
+        self.refresh = refresh
+        self.series = {name: array("d", bytes(8 * capacity)) for name in PROFILE_PHASES + ("total",)}
+        self.frames = 0
+        self.row = 0
+        self.frame_start = self.last = time.perf_counter()
+        self.overlay = False
+        self.overlay_surf = None
+
+    def begin(self, name):
+        """Open a nested span; only FrameTracer records spans."""
+
+    def end(self, phase):
+        """Charge the tail of the innermost span to phase and close it."""
+        self.lap(phase)
+
+    def begin_frame(self):
+        self.row = self.frames % self.capacity
+        for values in self.series.values():
+            values[self.row] = 0.0
+        self.frame_start = self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.series[phase][self.row] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        self.series["total"][self.row] = time.perf_counter() - self.frame_start
+        self.frames += 1
+
+    def recorded(self):
+        """Ring-buffer rows of the recorded frames, oldest first."""
+        n = min(self.frames, self.capacity)
+        start = self.frames - n
+        return [(start + i, (start + i) % self.capacity) for i in range(n)]
+
+    def percentiles(self, quantiles=(50, 95, 99)):
+        """{phase: [ms at each quantile]} over the frames in the buffer."""
+        rows = [row for _, row in self.recorded()]
+        result = {}
+        for name, values in self.series.items():
+            ordered = sorted(values[row] for row in rows)
+            result[name] = [ordered[min(len(ordered) - 1, len(ordered) * q // 100)] * 1000
+                            if ordered else 0.0 for q in quantiles]
+        return result
+
+    def export(self, path, pools=None):
+        """Write the buffered frames as JSON (.json) or CSV (anything else), in ms.
+
+        pools is Effects.high_water(); the JSON form records it alongside.
+        """
+        names = list(self.series)
+        frames = [[frame] + [round(self.series[name][row] * 1000, 4) for name in names]
+                  for frame, row in self.recorded()]
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump({"phases": names, "percentiles": self.percentiles(),
+                           "pools": {name: {"high_water": peak, "capacity": cap}
+                                     for name, (peak, cap) in (pools or {}).items()},
+                           "frames": frames}, f)
+        else:
+            with open(path, "w") as f:
+                f.write(",".join(["frame"] + names) + "\n")
+                for row in frames:
+                    f.write(",".join(map(str, row)) + "\n")
+
+    def draw(self, surf, font, pools=()):
+        """p50/p95/p99 table in the top-right corner, re-rendered every `refresh` frames.
+
+        pools is Effects.high_water(), listed underneath as peak/capacity.
+        """
+        if self.overlay_surf is None or self.frames % self.refresh == 0:
+            stats = self.percentiles()
+            lines = ["%-8s %5s %5s %5s" % ("ms", "p50", "p95", "p99")]
+            lines += ["%-8s %5.2f %5.2f %5.2f" % ((name,) + tuple(stats[name])) for name in stats]
+            lines += ["%-14s %3d/%d" % (name, peak, cap) for name, (peak, cap) in dict(pools).items()]
+            height = font.get_linesize()
+            width = max(font.size(line)[0] for line in lines)
+            self.overlay_surf = pygame.Surface((width + 8, height * len(lines) + 8))
+            self.overlay_surf.set_alpha(200)
+            for i, line in enumerate(lines):
+                self.overlay_surf.blit(font.render(line, True, C.WHITE), (4, 4 + i * height))
+        surf.blit(self.overlay_surf, (SCREEN_W - self.overlay_surf.get_width() - 4, 4))
+
+class FrameTracer(FrameProfiler):
+    """FrameProfiler that also streams every frame, span and lap to a Trace
+    Event Format file for Perfetto / chrome://tracing.
+
+    Spans nest frame > "step STATE" / "draw STATE" > phase laps. Events are
+    kept as raw (name, cat, start, end) tuples and only formatted and written
+    once a frame ends with `flush_every` or more buffered, so a lap costs one
+    tuple append on top of the profiler's bookkeeping. A span shares its edges with the laps inside it,
+    which keeps the nesting exact after rounding to microseconds.
+    """
+    def __init__(self, path, flush_every=4096, **kwargs):
+        super().__init__(**kwargs)
+        self.flush_every = flush_every
+        self.events = []
+        self.stack = []
+        self.frame_slot = 0
+        self.origin = time.perf_counter()
+        self.file = open(path, "w", buffering=1 << 16)
+        self.file.write('{"displayTimeUnit":"ms","traceEvents":[\n'
+                        '{"name":"thread_name","ph":"M","pid":1,"tid":1,"args":{"name":"game loop"}}')
+
+    def begin(self, name):
+        # Reserve the span's slot so it precedes its laps in the file;
+        # viewers nest equal-length events in file order
+        self.stack.append(len(self.events))
+        self.events.append((name, "state", self.last, self.last))
+
+    def end(self, phase):
+        self.lap(phase)
+        i = self.stack.pop()
+        name, cat, start, _ = self.events[i]
+        self.events[i] = (name, cat, start, self.last)
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.series[phase][self.row] += now - self.last
+        self.events.append((phase, "phase", self.last, now))
+        self.last = now
+
+    def begin_frame(self):
+        super().begin_frame()
+        self.frame_slot = len(self.events)
+        self.events.append(None)
+
+    def end_frame(self):
+        now = time.perf_counter()
+        self.series["total"][self.row] = now - self.frame_start
+        self.events[self.frame_slot] = ("frame %d" % self.frames, "frame", self.frame_start, now)
+        self.frames += 1
+        if len(self.events) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Format the buffered events as complete ("X") events and write them in one go."""
+        origin = self.origin
+        chunks = []
+        for name, cat, start, end in self.events:
+            ts = round((start - origin) * 1e6, 3)
+            dur = round((end - origin) * 1e6, 3) - ts
+            chunks.append(',\n{"name":"%s","cat":"%s","ph":"X","pid":1,"tid":1,"ts":%.3f,"dur":%.3f}'
+                          % (name, cat, ts, max(dur, 0.0)))
+        self.file.write("".join(chunks))
+        self.events.clear()
+
+    def close(self):
+        # run() returns mid-frame on quit; drop the unfinished frame
+        if self.frame_slot < len(self.events) and self.events[self.frame_slot] is None:
+            del self.events[self.frame_slot:]
+        self.flush()
+        self.file.write("\n]}\n")
+        self.file.close()
+
+# ─────────────────────────────────────────────────────────────
+# PRESENTATION
+# ─────────────────────────────────────────────────────────────
+# Screens that are drawn through the dirty-rect path
+DIRTY_RECT_STATES = (GameState.TITLE, GameState.MENU, GameState.OPTIONS)
+# Window events after which the OS may have lost what was on screen
+EXPOSE_EVENTS = tuple(getattr(pygame, name) for name in
+                      ("VIDEOEXPOSE", "WINDOWEXPOSED", "WINDOWRESTORED", "WINDOWSHOWN")
+                      if hasattr(pygame, name))
+
+class DirtyRects:
+    """Screen regions changed since the last present.
+
+    present() flips the whole display after a full redraw, pushes just
+    the marked rects with pygame.display.update otherwise, and does
+    nothing at all when the frame is unchanged.
+    """
+    def __init__(self):
+        self.rects = []
+        self.full = True
+
+    def mark(self, rect):
+        self.rects.append(pygame.Rect(rect))
+
+    def mark_all(self):
+        self.full = True
+
+    def present(self):
+        if self.full:
+            pygame.display.flip()
+        elif self.rects:
+            pygame.display.update(self.rects)
+        self.full = False
+        self.rects = []
+
 # ─────────────────────────────────────────────────────────────
 # GAME
 # ─────────────────────────────────────────────────────────────
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, level=None):
         global GFX
-        self.screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
-        self.clock = pygame.time.Clock()
-        GFX = Assets()
-        self.font = pygame.font.Font(None, int(16 * NES_PIXEL))
-        self.small_font = pygame.font.Font(None, int(12 * NES_PIXEL))
-        self.title_font = pygame.font.Font(None, int(24 * NES_PIXEL))
-        
-        # Menu sprites
-        self.cursor_sprite = create_sprite_surface(S_CURSOR, MARIO_PALETTE)
-        self.mario_icon = create_sprite_surface(S_MARIO_SMALL_ICON, MARIO_PALETTE)
-        self.mush_icon = create_sprite_surface(S_MUSHROOM_ICON, MUSH_PALETTE)
+        self.headless = headless
+        self.level = level  # LevelFile, or None for the built-in World 1-1
+        if headless:
+            # Pure simulation: no window, mixer, fonts or sprites
+            self.screen = None
+            self.clock = None
+        else:
+            STARTUP.mark("module + CLI setup")
+            init_display()
+            STARTUP.mark("display init")
+            self.screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
+            self.clock = pygame.time.Clock()
+            STARTUP.mark("window")
+            GFX = Assets()
+            STARTUP.mark("sprite atlas")
+            
+            # Menu sprites
+            self.cursor_sprite = GFX.cursor
+            self.mario_icon = GFX.mario_icon
+            self.mush_icon = GFX.mush_icon
+            self.level_renderer = LevelRenderer()
+        
+        # Loaded on first use - see the properties below
+        self.fonts = {}
+        self.digit_atlas = None
+        self.mixer_ready = None
+        
+        # Dirty-rect presentation for the static screens
+        self.dirty = DirtyRects()
+        self.dirty_mode = True
+        self.static_layer = None
+        self.static_key = None
+        self.sprite_rects = []
+        self.sprite_state = None
         
         # Game state
-        self.state = GameState.TITLE
+        self.state = GameState.PLAYING if headless else GameState.TITLE
         self.menu_selection = 0
         self.menu_options = ["GAME START", "OPTIONS", "SCORE RANKING"]
         self.options_selection = 0
@@ -1584,107 +3655,826 @@ class Game:
         ]
         
         self.key_delay = 0
+        self.show_ranking = False
+        self.frame = 0
+        self.physics = WalkerPhysics()
+        
+        # Replays
+        self.record_path = None
+        self.recording = None
+        self.last_replay = None
+        self.playback = None
+        self.rewind = RewindBuffer()
+        self.profiler = None  # FrameProfiler once switched on
+        self.effects = Effects()  # Kept for the session so pool peaks accumulate
         self.reset_level()
 
+    def load_font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = STARTUP.lazy("font %d" % size, pygame.font.Font,
+                                                   None, int(size * NES_PIXEL))
+        return font
+
+    @property
+    def font(self):
+        return self.load_font(16)
+
+    @property
+    def small_font(self):
+        return self.load_font(12)
+
+    @property
+    def title_font(self):
+        return self.load_font(24)
+
+    @property
+    def hud_digits(self):
+        """Glyph atlas for HUD numbers, built the first time the HUD is drawn."""
+        if self.digit_atlas is None:
+            self.digit_atlas = STARTUP.lazy("HUD glyph atlas", GlyphAtlas,
+                                            self.small_font, C.WHITE, "0123456789x-")
+        return self.digit_atlas
+
+    def load_level(self):
+        """Fresh grid and spawn index for a new attempt at the level."""
+        if self.level is not None:
+            self.grid, self.spawns = self.level.grid(), self.level.spawns()
+            self.flag_col = self.level.flag_col
+        else:
+            self.grid, placed = create_world_1_1()
+            self.spawns = SpawnIndex(placed)
+            self.flag_col = flag_column(self.grid)
+
+    def level_digest(self):
+        """Content hash of the level being played; see level_digest()."""
+        return self.level.digest() if self.level is not None else world_1_1_digest()
+
     def reset_level(self):
-        self.grid, self.enemies = create_world_1_1()
+        self.load_level()
+        self.enemies = []
         self.mario = Mario(3 * TILE_SIZE, 11 * TILE_SIZE)
         self.mario.lives = self.start_lives
         self.cam_x = 0
         self.target_cam = 0
         self.game_over = False
-        self.particles = []
-        self.popups = []
+        self.effects.clear()
         self.items = []
         self.time = 400
         self.time_tick = 0
         self.flag_y = 4 * TILE_SIZE
         self.world = 1
         self.stage = 1
+        self.index_entities()
+
+    def index_entities(self):
+        """(Re)build the broad-phase hashes from the entity lists."""
+        self.enemy_hash = SpatialHash()
+        self.item_hash = SpatialHash()
+        for e in self.enemies:
+            self.enemy_hash.move(e)
+        for it in self.items:
+            self.item_hash.move(it)
+
+    def respawn(self):
+        """Restart the stage after a death, keeping score, coins and lives."""
+        old = self.mario
+        self.load_level()
+        self.enemies = []
+        self.mario = Mario(3 * TILE_SIZE, 11 * TILE_SIZE)
+        self.mario.score = old.score
+        self.mario.coins = old.coins
+        self.mario.lives = old.lives
+        self.cam_x = 0
+        self.target_cam = 0
+        self.effects.clear()
+        self.items = []
+        self.time = 400
+        self.time_tick = 0
+        self.flag_y = 4 * TILE_SIZE
+        self.index_entities()
+
+    def update_playing(self, buttons):
+        """Advance the world by one frame. Needs no display, mixer or fonts."""
+        m = self.mario
+        grid = self.grid
+        
+        prof = self.profiler
+        
+        m.update(buttons, grid, self.effects, self.items)
+        
+        # Mario can't walk back off the left edge of the screen
+        if m.x < self.cam_x:
+            m.x = float(self.cam_x)
+            m.vx = 0
+        
+        self.collect_coins()
+        if prof:
+            prof.lap("mario")
+        
+        self.update_chunks()
+        
+        # Enemies and items walk as one batch
+        cam_x = self.cam_x
+        walkers = [e for e in self.enemies if e.begin_update(cam_x)]
+        walkers += [it for it in self.items if it.begin_update(cam_x)]
+        self.physics.step(walkers, grid)
+        for e in walkers:
+            e.end_update()
+        for e in self.enemies:
+            self.enemy_hash.move(e)
+        self.turn_enemies()
+        self.check_enemy_hits()
+        if prof:
+            prof.lap("enemies")
+        for it in self.items:
+            self.item_hash.move(it)
+        self.check_item_pickups()
+        if prof:
+            prof.lap("items")
+        
+        self.effects.update()
+        if prof:
+            prof.lap("effects")
+        
+        self.enemies = self.prune(self.enemies, self.enemy_hash)
+        self.items = self.prune(self.items, self.item_hash)
+        
+        # Camera only ever scrolls right, like the original
+        level_w = grid.width * TILE_SIZE
+        self.target_cam = max(self.target_cam, m.x + m.w // 2 - SCREEN_W // 2)
+        self.target_cam = min(self.target_cam, level_w - SCREEN_W)
+        self.cam_x = int(self.target_cam)
+        
+        # Level timer - one SMB "second" is 24 frames
+        if not m.finished:
+            self.time_tick += 1
+            if self.time_tick >= 24:
+                self.time_tick = 0
+                self.time -= 1
+                if self.time <= 0:
+                    m.dead = True
+        
+        # Flagpole
+        if not m.finished and self.flag_col >= 0 and m.x + m.w >= self.flag_col * TILE_SIZE + TILE_SIZE // 2:
+            m.finished = True
+            m.vx = m.vy = 0
+            flag_scores = [100, 100, 400, 400, 800, 800, 2000, 2000, 5000]
+            height = max(0, 13 * TILE_SIZE - int(m.y)) // TILE_SIZE
+            m.score += flag_scores[min(height, len(flag_scores) - 1)]
+            self.flag_y = max(self.flag_y, int(m.y))
+        if m.finished:
+            if self.flag_y < 12 * TILE_SIZE:
+                self.flag_y += 2 * NES_PIXEL
+            if self.time > 0 and m.finish_timer > 60:
+                self.time -= 1
+                m.score += 50
+            if m.finish_timer > 180 and self.time <= 0:
+                self.state = GameState.LEVEL_CLEAR
+        
+        if m.dead:
+            m.lives -= 1
+            if m.lives <= 0:
+                self.game_over = True
+                self.state = GameState.GAME_OVER
+            else:
+                self.respawn()
+
+    def step(self, buttons=0):
+        """Run exactly one fixed 1/FPS simulation step. Never renders.
+
+        buttons is a Buttons mask; while a replay is being recorded every
+        PLAYING frame's mask is appended to it.
+        """
+        self.frame += 1
+        prof = self.profiler
+        if prof:
+            prof.lap("world")
+            prof.begin("step " + self.state.name)
+        if self.state == GameState.PLAYING:
+            if self.recording is not None:
+                self.recording.record(buttons)
+            self.update_playing(buttons)
+            if self.state != GameState.PLAYING and self.recording is not None:
+                self.finish_recording()
+        elif self.state in (GameState.TITLE, GameState.MENU, GameState.OPTIONS):
+            self.title_timer += 1
+            if self.title_timer % 30 == 0:
+                self.title_blink = not self.title_blink
+        if prof:
+            prof.end("world")
+        return self.state
+
+    def advance(self, n_frames, input_stream=()):
+        """Fast-forward up to n_frames steps, drawing masks from input_stream.
+
+        Once the stream runs out no buttons are held. Stops early if the
+        game leaves the PLAYING state; returns the number of steps taken.
+        """
+        inputs = iter(input_stream)
+        for n in range(n_frames):
+            if self.state != GameState.PLAYING:
+                return n
+            self.step(next(inputs, 0))
+        return n_frames
+
+    def snapshot(self):
+        """Savestate of the simulation; see Snapshot."""
+        return Snapshot(self)
+
+    def restore(self, snapshot):
+        snapshot.restore(self)
+
+    def rewindable(self):
+        """Rewind is for casual play; recorded runs and replays never rewind."""
+        return (self.state == GameState.PLAYING and self.recording is None
+                and self.playback is None)
+
+    def finish_recording(self):
+        """Stamp the claimed result on the current recording and save it."""
+        replay, self.recording = self.recording, None
+        replay.claim(self)
+        if self.record_path:
+            replay.save(self.record_path)
+        self.last_replay = replay
+
+    def collect_coins(self):
+        m = self.mario
+        grid = self.grid
+        left, top = int(m.x), int(m.y)
+        x1 = max(0, left // TILE_SIZE)
+        x2 = min(grid.width - 1, (left + m.w - 1) // TILE_SIZE)
+        y1 = max(0, top // TILE_SIZE)
+        y2 = min(grid.height - 1, (top + m.h - 1) // TILE_SIZE)
+        for y in range(y1, y2 + 1):
+            for x in range(x1, x2 + 1):
+                if grid.get(x, y) == Tile.COIN:
+                    grid.set(x, y, Tile.AIR)
+                    self.add_coin()
+
+    def add_coin(self):
+        m = self.mario
+        m.coins += 1
+        m.score += 200
+        if m.coins >= 100:
+            m.coins -= 100
+            m.lives += 1
+
+    def update_chunks(self):
+        """Wake dormant enemies in chunks ahead of the camera, retire far-behind ones."""
+        left, right = chunk_window(self.cam_x)
+        for e in self.spawns.release_until(right):
+            self.enemies.append(e)
+            self.enemy_hash.move(e)
+        # Retired entities are pruned with the dead ones at the end of the frame
+        for e in self.enemies:
+            if e.x + e.w < left:
+                e.dead = True
+        for it in self.items:
+            if it.x + it.w < left:
+                it.dead = True
+
+    @staticmethod
+    def prune(entities, index):
+        """Drop dead entities from a list and its spatial hash."""
+        alive = []
+        for e in entities:
+            if e.dead:
+                index.remove(e)
+            else:
+                alive.append(e)
+        return alive
+
+    def turn_enemies(self):
+        """Walking enemies that bump into each other turn around."""
+        for a in self.enemies:
+            if a.dead or a.stomped or not a.activated or a.vx == 0:
+                continue
+            for b in self.enemy_hash.query_rect(a.x, a.y, a.x + a.w, a.y + a.h):
+                if b is a or b.dead or b.stomped or not b.activated:
+                    continue
+                if (a.x < b.x) == (a.vx > 0):
+                    a.vx = -a.vx
+                    break
+
+    def check_enemy_hits(self):
+        m = self.mario
+        if m.dead or m.finished:
+            return
+        left, top = int(m.x), int(m.y)
+        for e in self.enemy_hash.query_rect(left, top, left + m.w, top + m.h):
+            if e.dead or e.stomped or not e.activated:
+                continue
+            if m.star_power > 0:
+                e.dead = True
+                m.score += 100
+                self.effects.scores.spawn(e.x, e.y, 100)
+            elif m.vy > 0 and top + m.h - int(e.y) < TILE_SIZE // 2:
+                e.stomp()
+                m.vy = JUMP_FORCE * 0.5
+                m.score += 100
+                self.effects.scores.spawn(e.x, e.y, 100)
+            elif m.invincible == 0:
+                if m.big:
+                    m.big = False
+                    m.fire_power = False
+                    m.invincible = 2 * FPS
+                else:
+                    m.dead = True
+
+    def check_item_pickups(self):
+        m = self.mario
+        left, top = int(m.x), int(m.y)
+        for it in self.item_hash.query_rect(left, top, left + m.w, top + m.h):
+            if it.dead or getattr(it, "emerging", False):
+                continue
+            it.dead = True
+            if isinstance(it, Mushroom) and it.is_1up:
+                m.lives += 1
+                continue
+            if isinstance(it, Starman):
+                m.star_power = 10 * FPS
+            elif isinstance(it, FireFlower):
+                m.big = True
+                m.fire_power = True
+            else:
+                m.big = True
+            m.score += 1000
+            self.effects.scores.spawn(it.x, it.y, 1000)
 
     def draw_title_screen(self):
         """Draw SMB Deluxe style title screen"""
-        self.screen.fill((0, 0, 0))  # Black background like GBC
-        
-        self.title_timer += 1
-        if self.title_timer % 30 == 0:
-            self.title_blink = not self.title_blink
+        self.draw_title_static(self.screen)
+        for sprite, pos in self.title_sprites():
+            self.screen.blit(sprite, pos)
+
+    def draw_title_static(self, surf):
+        """Everything on the title screen that never animates"""
+        surf.fill((0, 0, 0))  # Black background like GBC
         
         # Draw decorative top border
-        pygame.draw.rect(self.screen, C.M_RED, (0, 0, SCREEN_W, 8 * NES_PIXEL))
-        pygame.draw.rect(self.screen, C.COIN_I, (0, 8 * NES_PIXEL, SCREEN_W, 2 * NES_PIXEL))
+        pygame.draw.rect(surf, C.M_RED, (0, 0, SCREEN_W, 8 * NES_PIXEL))
+        pygame.draw.rect(surf, C.COIN_I, (0, 8 * NES_PIXEL, SCREEN_W, 2 * NES_PIXEL))
         
         # "ULTRA" text - exciting and yellow
-        ultra_text = self.title_font.render("ULTRA", True, C.COIN_I)
-        self.screen.blit(ultra_text, (SCREEN_W//2 - ultra_text.get_width()//2, 28 * NES_PIXEL))
+        ultra_text = TEXT_CACHE.render(self.title_font, "ULTRA", C.COIN_I)
+        surf.blit(ultra_text, (SCREEN_W//2 - ultra_text.get_width()//2, 28 * NES_PIXEL))
         
         # "MARIO 2D BROS" title - big and red
-        title1 = self.title_font.render("MARIO 2D BROS", True, C.M_RED)
-        shadow1 = self.title_font.render("MARIO 2D BROS", True, C.BLACK)
-        self.screen.blit(shadow1, (SCREEN_W//2 - title1.get_width()//2 + 2, 48 * NES_PIXEL + 2))
-        self.screen.blit(title1, (SCREEN_W//2 - title1.get_width()//2, 48 * NES_PIXEL))
+        title1 = TEXT_CACHE.render(self.title_font, "MARIO 2D BROS", C.M_RED)
+        shadow1 = TEXT_CACHE.render(self.title_font, "MARIO 2D BROS", C.BLACK)
+        surf.blit(shadow1, (SCREEN_W//2 - title1.get_width()//2 + 2, 48 * NES_PIXEL + 2))
+        surf.blit(title1, (SCREEN_W//2 - title1.get_width()//2, 48 * NES_PIXEL))
+        
+        # Draw mushroom icon
+        mush_x = SCREEN_W//2 + 25 * NES_PIXEL
+        surf.blit(self.mush_icon, (mush_x, 85 * NES_PIXEL))
+        
+        # Copyright - Samsoft and Nintendo
+        copy_text1 = TEXT_CACHE.render(self.small_font, "[C] SAMSOFT 2026", C.WHITE)
+        surf.blit(copy_text1, (SCREEN_W//2 - copy_text1.get_width()//2, 150 * NES_PIXEL))
+        
+        copy_text2 = TEXT_CACHE.render(self.small_font, "[C] 1985 NINTENDO", C.WHITE)
+        surf.blit(copy_text2, (SCREEN_W//2 - copy_text2.get_width()//2, 162 * NES_PIXEL))
+        
+        # Draw bottom border
+        pygame.draw.rect(surf, C.COIN_I, (0, SCREEN_H - 10 * NES_PIXEL, SCREEN_W, 2 * NES_PIXEL))
+        pygame.draw.rect(surf, C.M_RED, (0, SCREEN_H - 8 * NES_PIXEL, SCREEN_W, 8 * NES_PIXEL))
+
+    def title_sprites(self):
+        """The title screen's animated parts as (surface, pos) pairs"""
+        sprites = []
         
         # Draw Mario icon
         mario_x = SCREEN_W//2 - 40 * NES_PIXEL
         mario_y = 85 * NES_PIXEL
         # Animate Mario bobbing
         bob = int(2 * NES_PIXEL * (1 if (self.title_timer // 15) % 2 == 0 else 0))
-        self.screen.blit(self.mario_icon, (mario_x, mario_y + bob))
-        
-        # Draw mushroom icon
-        mush_x = SCREEN_W//2 + 25 * NES_PIXEL
-        self.screen.blit(self.mush_icon, (mush_x, mario_y))
+        sprites.append((self.mario_icon, (mario_x, mario_y + bob)))
         
         # "PRESS START" blinking text
         if self.title_blink:
-            start_text = self.font.render("PRESS ENTER", True, C.WHITE)
-            self.screen.blit(start_text, (SCREEN_W//2 - start_text.get_width()//2, 125 * NES_PIXEL))
-        
-        # Copyright - Samsoft and Nintendo
-        copy_text1 = self.small_font.render("[C] SAMSOFT 2026", True, C.WHITE)
-        self.screen.blit(copy_text1, (SCREEN_W//2 - copy_text1.get_width()//2, 150 * NES_PIXEL))
-        
-        copy_text2 = self.small_font.render("[C] 1985 NINTENDO", True, C.WHITE)
-        self.screen.blit(copy_text2, (SCREEN_W//2 - copy_text2.get_width()//2, 162 * NES_PIXEL))
-        
-        # Draw bottom border
-        pygame.draw.rect(self.screen, C.COIN_I, (0, SCREEN_H - 10 * NES_PIXEL, SCREEN_W, 2 * NES_PIXEL))
-        pygame.draw.rect(self.screen, C.M_RED, (0, SCREEN_H - 8 * NES_PIXEL, SCREEN_W, 8 * NES_PIXEL))
+            start_text = TEXT_CACHE.render(self.font, "PRESS ENTER", C.WHITE)
+            sprites.append((start_text, (SCREEN_W//2 - start_text.get_width()//2, 125 * NES_PIXEL)))
+        return sprites
 
     def draw_main_menu(self):
         """Draw SMB Deluxe style main menu"""
-        self.screen.fill((0, 0, 48))  # Dark blue background
+        self.draw_menu_static(self.screen)
+        for sprite, pos in self.menu_sprites():
+            self.screen.blit(sprite, pos)
+
+    def draw_menu_static(self, surf):
+        """The main menu minus its cursor"""
+        surf.fill((0, 0, 48))  # Dark blue background
         
         # Top decorative area with ground tiles
         for x in range(0, SCREEN_W, TILE_SIZE):
-            self.screen.blit(GFX.tile_ground, (x, SCREEN_H - TILE_SIZE * 2))
-            self.screen.blit(GFX.tile_ground, (x, SCREEN_H - TILE_SIZE))
+            surf.blit(GFX.tile_ground, (x, SCREEN_H - TILE_SIZE * 2))
+            surf.blit(GFX.tile_ground, (x, SCREEN_H - TILE_SIZE))
         
         # Draw pipe decoration
-        self.screen.blit(GFX.pipe_tl, (20 * NES_PIXEL, SCREEN_H - TILE_SIZE * 4))
-        self.screen.blit(GFX.pipe_tr, (20 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 4))
-        self.screen.blit(GFX.pipe_l, (20 * NES_PIXEL, SCREEN_H - TILE_SIZE * 3))
-        self.screen.blit(GFX.pipe_r, (20 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 3))
+        surf.blit(GFX.pipe_tl, (20 * NES_PIXEL, SCREEN_H - TILE_SIZE * 4))
+        surf.blit(GFX.pipe_tr, (20 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 4))
+        surf.blit(GFX.pipe_l, (20 * NES_PIXEL, SCREEN_H - TILE_SIZE * 3))
+        surf.blit(GFX.pipe_r, (20 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 3))
         
         # Right side pipe
-        self.screen.blit(GFX.pipe_tl, (SCREEN_W - 70 * NES_PIXEL, SCREEN_H - TILE_SIZE * 4))
-        self.screen.blit(GFX.pipe_tr, (SCREEN_W - 70 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 4))
-        self.screen.blit(GFX.pipe_l, (SCREEN_W - 70 * NES_PIXEL, SCREEN_H - TILE_SIZE * 3))
-        self.screen.blit(GFX.pipe_r, (SCREEN_W - 70 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 3))
+        surf.blit(GFX.pipe_tl, (SCREEN_W - 70 * NES_PIXEL, SCREEN_H - TILE_SIZE * 4))
+        surf.blit(GFX.pipe_tr, (SCREEN_W - 70 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 4))
+        surf.blit(GFX.pipe_l, (SCREEN_W - 70 * NES_PIXEL, SCREEN_H - TILE_SIZE * 3))
+        surf.blit(GFX.pipe_r, (SCREEN_W - 70 * NES_PIXEL + TILE_SIZE, SCREEN_H - TILE_SIZE * 3))
         
         # Title at top
-        ultra = self.font.render("ULTRA MARIO 2D BROS", True, C.COIN_I)
-        self.screen.blit(ultra, (SCREEN_W//2 - ultra.get_width()//2, 15 * NES_PIXEL))
+        ultra = TEXT_CACHE.render(self.font, "ULTRA MARIO 2D BROS", C.COIN_I)
+        surf.blit(ultra, (SCREEN_W//2 - ultra.get_width()//2, 15 * NES_PIXEL))
         
-        copy1 = self.small_font.render("[C] SAMSOFT 2026  [C] 1985 NINTENDO", True, C.WHITE)
-        self.screen.blit(copy1, (SCREEN_W//2 - copy1.get_width()//2, 32 * NES_PIXEL))
+        copy1 = TEXT_CACHE.render(self.small_font, "[C] SAMSOFT 2026  [C] 1985 NINTENDO", C.WHITE)
+        surf.blit(copy1, (SCREEN_W//2 - copy1.get_width()//2, 32 * NES_PIXEL))
         
         # Menu box
-        box_x = 50 * NES_PIXEL
-        box_y = 48 * NES_PIXEL
-        box_w = SCREEN_W - 100 * NES_PIXEL
-        box_h = 80 * NES_PIXEL
+        box_x, box_y, box_w, box_h = self.menu_box()
         
         # Box border
-        pygame.draw.rect(self.screen, C.WHITE, (box_x, box_y, box_w, box_h), 2)
-        pygame.draw.rect(self.screen, (0, 0, 80), (box_x + 2, box_y + 2, box_w - 4, box_h - 4))
+        pygame.draw.rect(surf, C.WHITE, (box_x, box_y, box_w, box_h), 2)
+        pygame.draw.rect(surf, (0, 0, 80), (box_x + 2, box_y + 2, box_w - 4, box_h - 4))
+        
+        # Menu entries
+        for i, option in enumerate(self.menu_options):
+            y = box_y + 12 * NES_PIXEL + i * 20 * NES_PIXEL
+            text = TEXT_CACHE.render(self.font, option, C.WHITE)
+            surf.blit(text, (box_x + 30 * NES_PIXEL, y))
+        
+        # Score ranking
+        if self.show_ranking:
+            rank_y = box_y + box_h + 6 * NES_PIXEL
+            for i, (name, score) in enumerate(self.high_scores):
+                line = TEXT_CACHE.render(self.small_font, "%d. %-8s %6d" % (i + 1, name, score), C.COIN_I)
+                surf.blit(line, (SCREEN_W//2 - line.get_width()//2, rank_y + i * 10 * NES_PIXEL))
+
+    def menu_box(self):
+        return 50 * NES_PIXEL, 48 * NES_PIXEL, SCREEN_W - 100 * NES_PIXEL, 80 * NES_PIXEL
+
+    def menu_sprites(self):
+        box_x, box_y, _, _ = self.menu_box()
+        y = box_y + 12 * NES_PIXEL + self.menu_selection * 20 * NES_PIXEL
+        return [(self.cursor_sprite, (box_x + 10 * NES_PIXEL, y - 2 * NES_PIXEL))]
+
+    def draw_options(self):
+        """Draw options screen"""
+        self.draw_options_static(self.screen)
+        for sprite, pos in self.options_sprites():
+            self.screen.blit(sprite, pos)
+
+    def draw_options_static(self, surf):
+        surf.fill((0, 0, 48))
+        
+        header = TEXT_CACHE.render(self.font, "OPTIONS", C.COIN_I)
+        surf.blit(header, (SCREEN_W//2 - header.get_width()//2, 30 * NES_PIXEL))
+        
+        for i, option in enumerate(self.options_items):
+            y = 70 * NES_PIXEL + i * 20 * NES_PIXEL
+            text = TEXT_CACHE.render(self.font, option, C.WHITE)
+            surf.blit(text, (80 * NES_PIXEL, y))
+
+    def options_sprites(self):
+        y = 70 * NES_PIXEL + self.options_selection * 20 * NES_PIXEL
+        return [(self.cursor_sprite, (60 * NES_PIXEL, y - 2 * NES_PIXEL))]
+
+    def render_dirty(self):
+        """Dirty-rect path for the mostly static title/menu/options screens.
+
+        The static layer is drawn once per distinct screen content; each
+        frame only the animated sprites' old and new rects are restored,
+        redrawn and queued in self.dirty for pygame.display.update.
+        """
+        if self.state == GameState.TITLE:
+            key = (self.state,)
+            draw_static, sprites = self.draw_title_static, self.title_sprites()
+        elif self.state == GameState.MENU:
+            key = (self.state, self.show_ranking, tuple(self.high_scores))
+            draw_static, sprites = self.draw_menu_static, self.menu_sprites()
+        else:
+            key = (self.state, tuple(self.options_items))
+            draw_static, sprites = self.draw_options_static, self.options_sprites()
+        
+        if key != self.static_key:
+            if self.static_layer is None:
+                self.static_layer = self.screen.copy()
+            draw_static(self.static_layer)
+            self.static_key = key
+            self.screen.blit(self.static_layer, (0, 0))
+            self.dirty.mark_all()
+            self.sprite_state = None
+        
+        state = [(id(sprite), pos) for sprite, pos in sprites]
+        if state == self.sprite_state:
+            return  # Nothing moved - nothing to push
+        for rect in self.sprite_rects:
+            self.screen.blit(self.static_layer, rect, rect)
+            self.dirty.mark(rect)
+        self.sprite_rects = [self.screen.blit(sprite, pos) for sprite, pos in sprites]
+        for rect in self.sprite_rects:
+            self.dirty.mark(rect)
+        self.sprite_state = state
+
+    def draw_level(self):
+        """Draw the visible part of the tile grid from cached chunks"""
+        if self.grid.height * TILE_SIZE < SCREEN_H:
+            self.screen.fill(C.SKY)
+        self.level_renderer.draw(self.screen, self.grid, self.cam_x)
+        
+        # Flag slides down the pole at the end of the level
+        if self.flag_col >= 0:
+            self.screen.blit(GFX.flag, (self.flag_col * TILE_SIZE - TILE_SIZE // 2 - self.cam_x, self.flag_y + TILE_SIZE))
+
+    def draw_hud(self):
+        m = self.mario
+        cols = [
+            ("MARIO", "%06d" % m.score),
+            ("COINS", "x%02d" % m.coins),
+            ("WORLD", "%d-%d" % (self.world, self.stage)),
+            ("TIME", "%03d" % max(0, self.time)),
+        ]
+        for i, (label, value) in enumerate(cols):
+            x = 16 * NES_PIXEL + i * 60 * NES_PIXEL
+            self.screen.blit(TEXT_CACHE.render(self.small_font, label, C.WHITE), (x, 8 * NES_PIXEL))
+            # Changing numbers come from the glyph atlas, never the rasteriser
+            self.hud_digits.draw(self.screen, value, (x, 18 * NES_PIXEL))
+
+    def draw_playing(self):
+        prof = self.profiler
+        self.draw_level()
+        if prof:
+            prof.lap("tiles")
+        # Only entities in on-screen columns are drawn
+        first = self.cam_x // TILE_SIZE - 1
+        last = (self.cam_x + SCREEN_W) // TILE_SIZE
+        for it in self.item_hash.query_columns(first, last):
+            it.draw(self.screen, self.cam_x)
+        for e in self.enemy_hash.query_columns(first, last):
+            e.draw(self.screen, self.cam_x)
+        self.mario.draw(self.screen, self.cam_x)
+        self.effects.draw(self.screen, self.cam_x, self.small_font)
+        if prof:
+            prof.lap("sprites")
+        self.draw_hud()
+
+    def draw_message(self, text, color):
+        self.screen.fill((0, 0, 0))
+        msg = TEXT_CACHE.render(self.title_font, text, color)
+        self.screen.blit(msg, (SCREEN_W//2 - msg.get_width()//2, SCREEN_H//2 - msg.get_height()))
+        score = TEXT_CACHE.render(self.font, "SCORE %06d" % self.mario.score, C.WHITE)
+        self.screen.blit(score, (SCREEN_W//2 - score.get_width()//2, SCREEN_H//2 + 10 * NES_PIXEL))
+
+    def render(self):
+        """Draw the current state. Only called when a frame is presented."""
+        overlay = self.profiler is not None and self.profiler.overlay
+        if self.dirty_mode and self.state in DIRTY_RECT_STATES and not overlay:
+            self.render_dirty()
+            return
+        self.static_key = None
+        self.dirty.mark_all()
+        if self.state == GameState.TITLE:
+            self.draw_title_screen()
+        elif self.state == GameState.MENU:
+            self.draw_main_menu()
+        elif self.state == GameState.OPTIONS:
+            self.draw_options()
+        elif self.state == GameState.PLAYING:
+            self.draw_playing()
+        elif self.state == GameState.GAME_OVER:
+            self.draw_message("GAME OVER", C.M_RED)
+        elif self.state == GameState.LEVEL_CLEAR:
+            self.draw_message("COURSE CLEAR!", C.COIN_I)
+        if overlay:
+            self.profiler.draw(self.screen, self.small_font, self.effects.high_water())
+
+    def start_game(self):
+        self.reset_level()
+        self.state = GameState.PLAYING
+        self.playback = None
+        self.rewind.clear()
+        if self.record_path:
+            level_name = os.path.basename(self.level.source) if self.level is not None else ""
+            self.recording = Replay(self.world, self.stage, self.start_lives,
+                                    self.level_digest(), level_name)
+
+    def watch_replay(self, replay):
+        """Play a replay back in the window through the normal step path."""
+        if replay.level_digest != self.level_digest():
+            raise ReplayError("replay was recorded on a different level")
+        self.start_lives = replay.start_lives
+        self.start_game()
+        self.recording = None
+        self.playback = iter(replay.frames)
+
+    def record_score(self):
+        self.high_scores.append(("PLAYER", self.mario.score))
+        self.high_scores.sort(key=lambda e: e[1], reverse=True)
+        del self.high_scores[5:]
+
+    def handle_key(self, key):
+        """Menu navigation; gameplay itself reads button masks in step()."""
+        if key == pygame.K_F3:
+            # The profiler is opt-in: the first F3 turns it on
+            if self.profiler is None:
+                self.profiler = FrameProfiler()
+            self.profiler.overlay = not self.profiler.overlay
+            return
+        enter = key in (pygame.K_RETURN, pygame.K_KP_ENTER)
+        if self.state == GameState.TITLE:
+            if enter:
+                self.state = GameState.MENU
+        elif self.state == GameState.MENU:
+            if key == pygame.K_UP:
+                self.menu_selection = (self.menu_selection - 1) % len(self.menu_options)
+            elif key == pygame.K_DOWN:
+                self.menu_selection = (self.menu_selection + 1) % len(self.menu_options)
+            elif key == pygame.K_ESCAPE:
+                self.state = GameState.TITLE
+            elif enter:
+                if self.menu_selection == 0:
+                    self.start_game()
+                elif self.menu_selection == 1:
+                    self.state = GameState.OPTIONS
+                else:
+                    self.show_ranking = not self.show_ranking
+        elif self.state == GameState.OPTIONS:
+            if key == pygame.K_UP:
+                self.options_selection = (self.options_selection - 1) % len(self.options_items)
+            elif key == pygame.K_DOWN:
+                self.options_selection = (self.options_selection + 1) % len(self.options_items)
+            elif key == pygame.K_ESCAPE:
+                self.state = GameState.MENU
+            elif enter:
+                if self.options_selection == 0:
+                    self.sound_on = not self.sound_on
+                elif self.options_selection == 1:
+                    self.music_on = not self.music_on
+                elif self.options_selection == 2:
+                    self.start_lives = self.start_lives % 5 + 1
+                else:
+                    self.state = GameState.MENU
+                self.options_items[:3] = [
+                    "SOUND: " + ("ON" if self.sound_on else "OFF"),
+                    "MUSIC: " + ("ON" if self.music_on else "OFF"),
+                    "LIVES: %d" % self.start_lives,
+                ]
+        elif self.state == GameState.PLAYING:
+            if key == pygame.K_ESCAPE:
+                self.state = GameState.MENU
+        elif self.state in (GameState.GAME_OVER, GameState.LEVEL_CLEAR):
+            if enter:
+                self.record_score()
+                self.state = GameState.TITLE
+
+    def run(self):
+        """Fixed-timestep loop: simulate in 1/FPS steps, render once per presented frame."""
+        step_ms = 1000.0 / FPS
+        acc = 0.0
+        last = pygame.time.get_ticks()
+        while True:
+            prof = self.profiler
+            if prof:
+                prof.begin_frame()
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+                if event.type == pygame.KEYDOWN:
+                    self.handle_key(event.key)
+                elif event.type in EXPOSE_EVENTS:
+                    self.dirty.mark_all()
+            
+            now = pygame.time.get_ticks()
+            acc += now - last
+            last = now
+            
+            keys = pygame.key.get_pressed()
+            buttons = Buttons.from_keys(keys)
+            rewinding = keys[pygame.K_BACKSPACE] or keys[pygame.K_r]
+            if prof:
+                prof.lap("input")
+            steps = 0
+            while acc >= step_ms and steps < MAX_CATCHUP:
+                if self.playback is not None and self.state == GameState.PLAYING:
+                    buttons = next(self.playback, 0)
+                if self.rewindable():
+                    if rewinding:
+                        self.rewind.rewind(self)
+                    else:
+                        self.rewind.push(self, buttons)
+                        self.step(buttons)
+                else:
+                    self.step(buttons)
+                acc -= step_ms
+                steps += 1
+            if steps == MAX_CATCHUP:
+                acc = 0.0  # Too far behind - drop time rather than spiral
+            
+            if prof:
+                prof.begin("draw " + self.state.name)
+            self.render()
+            if prof:
+                prof.end("ui")
+            self.dirty.present()
+            if prof:
+                prof.lap("flip")
+                prof.end_frame()
+            STARTUP.frame_presented()
+            if self.mixer_ready is None:
+                # Opening the audio device can be slow; keep it off the first frame
+                self.mixer_ready = STARTUP.lazy("mixer", init_mixer)
+            self.clock.tick(FPS)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Ultra Mario 2D Bros")
+    parser.add_argument("--record", metavar="FILE", help="record the next run to a replay file")
+    parser.add_argument("--replay", metavar="FILE", help="watch a recorded replay")
+    parser.add_argument("--level", metavar="FILE",
+                        help="play a level file instead of World 1-1")
+    parser.add_argument("--levels", metavar="DIR", action="append", default=[],
+                        help="trusted level directory; --replay and --verify find "
+                             "custom levels here by digest (repeatable)")
+    parser.add_argument("--tiles", choices=TILE_STORES, default="mapped",
+                        help="how --level tiles are held: mapped from the compile cache "
+                             "(default), chunked in memory, or streamed from disk")
+    parser.add_argument("--write-level", metavar="FILE", help="write World 1-1 as a level file and exit")
+    parser.add_argument("--compile-level", metavar="FILE",
+                        help="compile --level (default World 1-1) to a mappable .smbc file and exit")
+    parser.add_argument("--bench-tiles", action="store_true",
+                        help="compare memory and read cost of the tile stores and exit")
+    parser.add_argument("--bench-entities", action="store_true",
+                        help="measure entity memory and update throughput and exit")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print where startup time goes once the first frame is up")
+    parser.add_argument("--profile-out", metavar="FILE",
+                        help="profile every frame and write the timings (.json or .csv) on exit; "
+                             "the JSON form also has effect pool peaks")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a per-frame timeline for Perfetto / chrome://tracing")
+    parser.add_argument("--verify", metavar="PATH", nargs="+",
+                        help="verify replay files (or directories of .smbr files) headlessly")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes for --verify (default: all cores)")
+    args = parser.parse_args(argv)
+    
+    if args.bench_tiles:
+        bench_tiles()
+        return 0
+    if args.bench_entities:
+        bench_entities()
+        return 0
+    if args.write_level:
+        write_level(args.write_level, *create_world_1_1())
+        return 0
+    if args.compile_level:
+        if args.level:
+            compile_level_file(args.compile_level, LevelFile(args.level))
+        else:
+            compile_level(args.compile_level, *create_world_1_1())
+        return 0
+    if args.verify:
+        sources = args.levels + ([args.level] if args.level else [])
+        results, stats = verify_replays(replay_files(args.verify), args.jobs, sources)
+        for r in results:
+            status = "OK  " if r.ok else "FAIL"
+            print("%s %s score=%d time=%d finished=%s frames=%d %.1fms %s" % (
+                status, r.path, r.score, r.time, r.finished, r.frames,
+                r.seconds * 1000, r.error))
+        print("%(passed)d/%(runs)d passed on %(workers)d workers in %(seconds).2fs "
+              "(%(runs_per_hour).0f runs/h, %(frames_per_second).0f frames/s)" % stats)
+        return 0 if stats["failed"] == 0 else 1
+    
+    STARTUP.verbose = args.startup_report
+    try:
+        replay = Replay.load(args.replay) if args.replay else None
+        if args.level:
+            level = open_level(args.level, args.tiles)
+        elif replay:
+            level = replay_level(replay, args.levels)  # the level it was recorded on
+        else:
+            level = None
+        game = Game(level=level)
+        game.record_path = args.record
+        if replay:
+            game.watch_replay(replay)
+    except (ReplayError, LevelError) as e:
+        parser.error(str(e))
+    if args.trace:
+        game.profiler = FrameTracer(args.trace)
+    elif args.profile_out:
+        game.profiler = FrameProfiler()
+    game.run()
+    if args.profile_out:
+        game.profiler.export(args.profile_out, game.effects.high_water())
+    if args.trace:
+        game.profiler.close()
+    pygame.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())